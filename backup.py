@@ -4,10 +4,22 @@
 __doc__ = "A simple backup script for important data in the Telegram channel"
 
 import os
+import gzip
+import json
+import stat
+import time
+import queue
+import asyncio
 import tarfile
 import logging
+import threading
+from contextlib import ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from telethon import TelegramClient
+import zstandard as zstd
+from telethon import TelegramClient, helpers
+from telethon.errors import FloodWaitError
+from telethon.tl import functions, types
 from dotenv import load_dotenv
 from utils import get_session_file
 
@@ -19,20 +31,57 @@ logging.basicConfig(
 )
 
 # ================= Backup configuration =================
-BACKUP_DIR = "/tmp"
+# .env next to this script; an explicit path spares load_dotenv() the
+# call-stack inspection and directory walk of find_dotenv()
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+# Staging directory for the archive (override with BACKUP_DIR); kept off /tmp,
+# which is often RAM-backed tmpfs on small VPSes
+BACKUP_DIR = "/var/cache/userbot-backup"
 DATE = datetime.now().strftime("%Y-%m-%d-%H-%M")
-ARCHIVE_NAME = os.path.join(BACKUP_DIR, f"backup-{DATE}.tar.gz")
+ARCHIVE_BASENAME = f"backup-{DATE}"
+# BACKUP_COMPRESSION values and the archive extension each one produces;
+# "none" suits data that is already compressed (sqlite, media)
+ARCHIVE_EXTENSIONS = {"zstd": ".tar.zst", "gzip": ".tar.gz", "none": ".tar"}
+DEFAULT_COMPRESSION = "zstd"
+# Chunk size tarfile uses when copying file contents (default is 16 KiB)
+COPY_BUFSIZE = 2 * 1024 * 1024
+# Buffer size for writing the compressed archive to disk
+WRITE_BUFSIZE = 1024 * 1024
+# Threads that stat/open files ahead of the tar writer and how far ahead they go
+WALK_WORKERS = 4
+WALK_QUEUE_SIZE = 16
+# Telegram upload part size and the size from which big-file parts are used
+UPLOAD_PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+# How often the uploader checks the archive for newly flushed bytes
+UPLOAD_POLL_INTERVAL = 0.5
+# How many upload parts are in flight at once
+UPLOAD_WORKERS = 8
+# Attempts per Telegram request before the upload is given up
+UPLOAD_RETRIES = 3
+# Upload progress is logged on every whole percent or at least this often (s)
+PROGRESS_LOG_INTERVAL = 5
+# Manifest of the last full backup; runs in between only archive changed files
+INDEX_FILE = "/var/lib/userbot/backup.index.json"
+FULL_BACKUP_INTERVAL = 30 * 86400
+# Optional zstd dictionary trained on the small config files, e.g.
+#   zstd --train -r /etc/wireguard /etc/ssh /etc/zapret -o /var/lib/userbot/cfg.zdict
+# Archives made with it need it to restore (zstd -d -D cfg.zdict), so keep a
+# copy outside the backups. Override the path with BACKUP_ZSTD_DICT
+ZSTD_DICT_FILE = "/var/lib/userbot/cfg.zdict"
 
+# Caches and logs inside the backed up folders that are not worth archiving
+EXCLUDE_SUFFIXES = (".log", ".tmp")
+EXCLUDE_SUBSTRINGS = ("querylog",)
+
+# Small, rarely changing configs go first so the dictionary covers them;
+# bulky and frequently changing data follows
 FILES_TO_BACKUP = [
     "/etc/wireguard",
     "/etc/sysctl.d/",
     "/etc/zapret",
     "/etc/hosts",
     "/etc/ssh",
-    "/opt/AdGuardHome/data",
-    "/opt/userbot/db.sqlite3",
-    "/opt/userbot/sessions",
-    "/opt/userbot/media",
     "/opt/userbot/.env",
     "/opt/zapret/config",
     "/opt/zapret/init.d/sysv/custom.d/",
@@ -42,66 +91,453 @@ FILES_TO_BACKUP = [
     "/root/.ssh",
     "/root/.bashrc",
     "/root/.config/systemd/journald.conf",
+    "/opt/AdGuardHome/data",
+    "/opt/userbot/db.sqlite3",
+    # The bot's database runs in WAL mode; recent commits live here until a checkpoint
+    "/opt/userbot/db.sqlite3-wal",
+    "/opt/userbot/sessions",
+    "/opt/userbot/media",
     # __file__,
 ]
 
 
 # ================= Functions =================
-def create_archive(archive_name, files):
-    """Create a tar.gz archive from the list of files/folders."""
-    os.makedirs(os.path.dirname(archive_name), exist_ok=True)
-    logging.info("Creating archive: %s", archive_name)
-    with tarfile.open(archive_name, "w:gz") as tar:
+def _is_excluded(name):
+    """Check whether a file name matches EXCLUDE_SUFFIXES/EXCLUDE_SUBSTRINGS."""
+    return name.endswith(EXCLUDE_SUFFIXES) or any(
+        part in name for part in EXCLUDE_SUBSTRINGS
+    )
+
+
+def _walk(path, is_dir):
+    """Yield path and everything below it, in the same order as tar.add.
+
+    is_dir tells whether path is a real directory (not a symlink to one); for
+    entries below it the answer comes from the scandir results. Files below
+    path that match the exclusion patterns are left out.
+    """
+    yield path
+    if not is_dir:
+        return
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        logging.warning("Cannot read directory %s: %s", path, e)
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path, True)
+        elif not _is_excluded(entry.name):
+            yield entry.path
+
+
+def _prepare_member(path, baseline):
+    """Stat path and open it if it is a regular file.
+
+    Returns (stat result, file object, unchanged). Regular files whose
+    (mtime, size) match baseline are not opened and come back flagged as
+    unchanged. The TarInfo is built later by the writer, in archive order,
+    so that hardlinks always point to a member written before them.
+    """
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode):
+        return st, None, False
+    if baseline and baseline.get(path) == [st.st_mtime, st.st_size]:
+        return st, None, True
+    return st, open(path, "rb"), False
+
+
+def _queue_members(files, baseline, pool, members):
+    """Walk files and queue (path, future) pairs in archive order.
+
+    A (path, None) pair marks that a top-level entry has been fully queued,
+    and a final None tells the consumer that the walk is over.
+    """
+    try:
         for f in files:
-            if os.path.exists(f):
-                tar.add(f)
-                logging.info("Added: %s", f)
-            else:
+            try:
+                st = os.lstat(f)
+            except FileNotFoundError:
                 logging.warning("File or folder not found: %s", f)
+                continue
+            for path in _walk(f, stat.S_ISDIR(st.st_mode)):
+                members.put(
+                    (path, pool.submit(_prepare_member, path, baseline))
+                )
+            members.put((f, None))
+    finally:
+        members.put(None)
+
+
+def _open_tar(stack, archive_name, compression, zstd_dict=None):
+    """Open archive_name as a streaming tar with the given compression.
+
+    tarfile always writes a plain "w|" stream; compression happens outside
+    it (multi-threaded for zstd), so tarfile adds no buffering of its own.
+    """
+    fout = stack.enter_context(open(archive_name, "wb", buffering=WRITE_BUFSIZE))
+    if compression == "zstd":
+        cctx = zstd.ZstdCompressor(level=3, dict_data=zstd_dict, threads=-1)
+        fout = stack.enter_context(cctx.stream_writer(fout, write_size=WRITE_BUFSIZE))
+    elif compression == "gzip":
+        fout = stack.enter_context(gzip.GzipFile(fileobj=fout, mode="wb"))
+
+    # bufsize keeps tarfile's stream from re-slicing each chunk into
+    # 10 KiB records before handing it to the compressor
+    return stack.enter_context(
+        tarfile.open(
+            fileobj=fout,
+            mode="w|",
+            format=tarfile.PAX_FORMAT,
+            bufsize=COPY_BUFSIZE,
+            copybufsize=COPY_BUFSIZE,
+        )
+    )
+
+
+def create_archive(
+    archive_name,
+    files,
+    baseline=None,
+    manifest=None,
+    compression=DEFAULT_COMPRESSION,
+    zstd_dict=None,
+):
+    """Create a tar archive from the list of files/folders.
+
+    With zstd (the default) the tar stream is written uncompressed and piped
+    into a multi-threaded compressor, so compression uses every available
+    core. Directory walking, stat() and open() run on a small thread pool
+    ahead of the writer, so metadata I/O overlaps with compression.
+
+    Regular files listed in baseline ({path: [mtime, size]}) with the same
+    mtime and size are left out. If manifest is given, it is filled with
+    the (mtime, size) of every regular file seen. zstd_dict, if given, primes
+    the zstd compressor.
+    """
+    os.makedirs(os.path.dirname(archive_name), exist_ok=True)
+    logging.info("Creating archive: %s", archive_name)
+    unchanged_count = 0
+    with ExitStack() as stack:
+        tar = _open_tar(stack, archive_name, compression, zstd_dict)
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=WALK_WORKERS))
+        members = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+        threading.Thread(
+            target=_queue_members,
+            args=(files, baseline, pool, members),
+            daemon=True,
+        ).start()
+
+        while (item := members.get()) is not None:
+            path, future = item
+            if future is None:
+                logging.info("Added: %s", path)
+                continue
+            try:
+                st, fileobj, unchanged = future.result()
+            except OSError as e:
+                logging.warning("Skipped %s: %s", path, e)
+                continue
+            try:
+                # gettarinfo() records hardlinks in tar.inodes, so it runs
+                # here and not on the pool
+                tarinfo = tar.gettarinfo(path)
+                if tarinfo is None:
+                    logging.warning("Unsupported file type, skipped: %s", path)
+                    continue
+                if manifest is not None and tarinfo.isreg():
+                    manifest[path] = [tarinfo.mtime, tarinfo.size]
+                if unchanged and tarinfo.isreg():
+                    # Later links to this inode must carry the data themselves
+                    tar.inodes.pop((st.st_ino, st.st_dev), None)
+                    unchanged_count += 1
+                    continue
+                if tarinfo.isreg() and fileobj is None:
+                    # Changed type between the pool's stat and now
+                    fileobj = open(path, "rb")
+                tar.addfile(tarinfo, fileobj)
+            except OSError as e:
+                logging.warning("Skipped %s: %s", path, e)
+            finally:
+                if fileobj is not None:
+                    fileobj.close()
+    if unchanged_count:
+        logging.info("Left out %d unchanged files", unchanged_count)
     logging.info("Archive created: %s", archive_name)
     return archive_name
 
 
-def send_file(api_id, api_hash, dest, file_path, session):
-    """Send the archive file to Telegram channel/user."""
-    client = TelegramClient(session, api_id, api_hash)
+def load_zstd_dict(dict_file):
+    """Load the trained zstd dictionary, or None if there is none."""
+    try:
+        with open(dict_file, "rb") as f:
+            return zstd.ZstdCompressionDict(f.read())
+    except FileNotFoundError:
+        return None
+
 
-    async def _send():
-        await client.start()
-        size_mb = os.path.getsize(file_path) / 1024 / 1024
-        logging.info("Sending %s (%.2f MB) -> %s", file_path, size_mb, dest)
+def load_index(index_file):
+    """Load the manifest of the last full backup, or None if there is no valid one."""
+    try:
+        with open(index_file, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(index, dict)
+        or not isinstance(index.get("full_at"), (int, float))
+        or not isinstance(index.get("files"), dict)
+    ):
+        logging.warning("Ignoring malformed backup index %s", index_file)
+        return None
+    return index
 
-        def progress(current, total):
-            percent = current * 100 / total if total else 0
-            logging.info("Progress: %.1f%%", percent)
 
-        await client.send_file(
+def save_index(index_file, index):
+    """Atomically write the backup manifest."""
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+
+
+def _flushed_size(path):
+    """Return how many bytes of path are on disk so far (0 if not created yet)."""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+async def _with_retries(request, description):
+    """Await request() with up to UPLOAD_RETRIES attempts on transient errors.
+
+    Waits 2^attempt seconds between attempts, or as long as Telegram asks
+    on FloodWaitError.
+    """
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            return await request()
+        except (FloodWaitError, ConnectionError, TimeoutError) as e:
+            if attempt == UPLOAD_RETRIES - 1:
+                raise
+            delay = e.seconds if isinstance(e, FloodWaitError) else 2**attempt
+            logging.warning("%s failed (%s), retrying in %ds", description, e, delay)
+            await asyncio.sleep(delay)
+
+
+async def _upload_while_writing(client, file_path, archive, progress):
+    """Upload file_path part by part while archive (a Future) is still writing it.
+
+    Telegram accepts big-file parts with an unknown total (-1) until the size
+    is known, so upload overlaps with compression. Up to UPLOAD_WORKERS parts
+    are uploaded concurrently. Returns the final size together with an
+    InputFileBig, or together with file_path if the finished archive is too small for
+    a big-file upload.
+    """
+    while not archive.done() and _flushed_size(file_path) < BIG_FILE_SIZE:
+        await asyncio.sleep(UPLOAD_POLL_INTERVAL)
+
+    if archive.done():
+        archive.result()
+        size = os.path.getsize(file_path)
+        if size < BIG_FILE_SIZE:
+            return size, file_path
+
+    file_id = helpers.generate_random_long()
+    semaphore = asyncio.Semaphore(UPLOAD_WORKERS)
+    pending = set()
+    uploaded = 0
+    part = 0
+    # Parts finish out of order, so progress is only given as a share of the
+    # final size; until that is known it is None
+    final_size = None
+
+    async def _save_part(index, total, data):
+        nonlocal uploaded
+        try:
+            await _with_retries(
+                lambda: client(
+                    functions.upload.SaveBigFilePartRequest(file_id, index, total, data)
+                ),
+                f"Upload of part {index}",
+            )
+        finally:
+            semaphore.release()
+        uploaded += len(data)
+        progress(uploaded, final_size)
+
+    try:
+        with open(file_path, "rb") as f:
+            while True:
+                finished = archive.done()
+                size = os.path.getsize(file_path)
+                total = -(-size // UPLOAD_PART_SIZE) if finished else -1
+                if finished:
+                    final_size = size
+
+                while (part + 1) * UPLOAD_PART_SIZE <= size or (
+                    finished and part < total
+                ):
+                    await semaphore.acquire()
+                    task = asyncio.create_task(
+                        _save_part(part, total, f.read(UPLOAD_PART_SIZE))
+                    )
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    part += 1
+
+                if finished:
+                    break
+                await asyncio.sleep(UPLOAD_POLL_INTERVAL)
+
+        await asyncio.gather(*pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    archive.result()
+    return size, types.InputFileBig(file_id, part, os.path.basename(file_path))
+
+
+async def send_file(client, dest, file_path, archive=None, caption=None):
+    """Send the archive file to Telegram channel/user using a started client.
+
+    If archive (the Future of create_archive) is given, the file is still being
+    written and its parts are uploaded as soon as they hit the disk. Big files
+    are uploaded with parallel parts either way.
+    """
+    last_percent = -1
+    last_logged_at = 0.0
+
+    def progress(current, total):
+        nonlocal last_percent, last_logged_at
+        now = time.monotonic()
+        if total is None:
+            # Still streaming, the final size is not known yet
+            if now - last_logged_at < PROGRESS_LOG_INTERVAL:
+                return
+            last_logged_at = now
+            logging.info("Uploaded %.2f MB", current / 1024 / 1024)
+            return
+        percent = current * 100 / total if total else 0
+        if (
+            int(percent) == last_percent
+            and now - last_logged_at < PROGRESS_LOG_INTERVAL
+        ):
+            return
+        last_percent, last_logged_at = int(percent), now
+        logging.info("Progress: %.1f%%", percent)
+
+    written = archive
+    if written is None:
+        written = Future()
+        written.set_result(file_path)
+    else:
+        logging.info("Streaming %s -> %s while it is being written", file_path, dest)
+    size, file = await _upload_while_writing(client, file_path, written, progress)
+
+    logging.info("Sending %s (%.2f MB) -> %s", file_path, size / 1024 / 1024, dest)
+
+    await _with_retries(
+        lambda: client.send_file(
             dest,
-            file_path,
+            file,
+            caption=caption,
+            force_document=True,
+            file_size=size,
             progress_callback=progress,
-        )
-        logging.info("File sent successfully")
-
-    with client:
-        client.loop.run_until_complete(_send())
+        ),
+        "Sending the archive",
+    )
+    logging.info("File sent successfully")
 
 
 # ================= Main logic =================
-def main():
-    load_dotenv()
+async def main_async():
+    load_dotenv(ENV_FILE)
+
+    env = {
+        key: os.environ.get(key, "").strip()
+        for key in ("API_ID", "API_HASH", "BACKUP_CHANNEL_ID", "BACKUPER_SESSION")
+    }
+    missing = [key for key, value in env.items() if not value]
+    if missing:
+        logging.error("%s not set in .env", ", ".join(missing))
+        return
 
-    api_id = int(os.getenv("API_ID", "0"))
-    api_hash = os.getenv("API_HASH", "")
-    dest = int(os.getenv("BACKUP_CHANNEL_ID", "0"))
-    session = get_session_file(os.getenv("BACKUPER_SESSION", ""))
+    try:
+        api_id = int(env["API_ID"])
+        dest = int(env["BACKUP_CHANNEL_ID"])
+    except ValueError:
+        logging.error("API_ID and BACKUP_CHANNEL_ID must be integers")
+        return
+    api_hash = env["API_HASH"]
+    session = get_session_file(env["BACKUPER_SESSION"])
 
-    if not api_id or not api_hash or not dest:
-        logging.error("API_ID, API_HASH or BACKUP_CHANNEL_ID not set in .env")
+    compression = os.environ.get("BACKUP_COMPRESSION", DEFAULT_COMPRESSION).lower()
+    if compression not in ARCHIVE_EXTENSIONS:
+        logging.error(
+            "BACKUP_COMPRESSION must be one of: %s", ", ".join(ARCHIVE_EXTENSIONS)
+        )
         return
+    archive_name = os.path.join(
+        os.environ.get("BACKUP_DIR", BACKUP_DIR),
+        ARCHIVE_BASENAME + ARCHIVE_EXTENSIONS[compression],
+    )
+    zstd_dict = None
+    if compression == "zstd":
+        zstd_dict = load_zstd_dict(os.environ.get("BACKUP_ZSTD_DICT", ZSTD_DICT_FILE))
+    if zstd_dict is not None:
+        logging.info("Using zstd dictionary %d", zstd_dict.dict_id())
 
-    archive = create_archive(ARCHIVE_NAME, FILES_TO_BACKUP)
-    send_file(api_id, api_hash, dest, archive, session)
-    os.remove(archive)
+    # Between full backups only files changed since the last full one are archived
+    index = load_index(INDEX_FILE)
+    if index is None or time.time() - index["full_at"] >= FULL_BACKUP_INTERVAL:
+        baseline, manifest = None, {}
+        caption = "Full backup"
+    else:
+        baseline, manifest = index["files"], None
+        full_date = datetime.fromtimestamp(index["full_at"]).strftime("%Y-%m-%d")
+        caption = f"Differential backup (changes since full backup of {full_date})"
+    logging.info("%s", caption)
+
+    # One client for the whole run. A saved session only needs connect();
+    # client.start() would add a get_me() round trip and may prompt for login
+    client = TelegramClient(session, api_id, api_hash)
+    await client.connect()
+    try:
+        if not await client.is_user_authorized():
+            logging.error("Session %s is not authorized", session)
+            return
+
+        # Compress in a worker thread while the upload streams finished parts
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            archive = executor.submit(
+                create_archive,
+                archive_name,
+                FILES_TO_BACKUP,
+                baseline,
+                manifest,
+                compression,
+                zstd_dict,
+            )
+            try:
+                await send_file(client, dest, archive_name, archive, caption)
+                if manifest is not None:
+                    save_index(INDEX_FILE, {"full_at": time.time(), "files": manifest})
+            finally:
+                await asyncio.wait([asyncio.wrap_future(archive)])
+                if os.path.exists(archive_name):
+                    os.remove(archive_name)
+    finally:
+        await client.disconnect()
+
+
+def main():
+    asyncio.run(main_async())
 
 
 if __name__ == "__main__":
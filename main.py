@@ -5,9 +5,10 @@ import os
 import sys
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, Optional, Set, List
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, List
 
 from dotenv import load_dotenv
 from telethon import TelegramClient, events, types
@@ -17,15 +18,20 @@ from telethon.errors import (
     FilePartMissingError
 )
 
-from sqlite import SQLite
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from sqlite import DNS_FLUSH_INTERVAL, SQLite
 from utils import (
     extract_hashtags,
     get_session_file,
     prompt_to_text,
+    normalize_command,
     normalize_domain,
-    write_to_zapret_file,
-    get_all_zapret_files,
-    check_site_in_zapret_file,
+    write_many_to_zapret_file,
+    find_site_in_zapret_files,
 )
 from wireguard import WireGuardManager
 from strings import (
@@ -52,6 +58,9 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 
+# Signature shared by the command handlers
+CommandHandler = Callable[[events.NewMessage.Event], Awaitable[None]]
+
 
 @dataclass
 class Config:
@@ -107,15 +116,61 @@ class TelegramBot:
             proxy=config.proxy,
         )
         self.db = SQLite()
+        # Blocking work (SQLite, zapret files, wg commands) runs on this thread
+        # instead of the event loop; a single worker keeps database access serial
+        self.io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
         self.wg_manager = WireGuardManager(db=self.db)
         self.hashtags: Set[str] = set()
+        # Navigation text for the current hashtags; None when it needs a rebuild
+        self.nav_text: Optional[str] = None
+        # Sorted hashtags for taglist; None when it needs a rebuild
+        self.sorted_hashtags: Optional[List[str]] = None
         self.nav_message_id: Optional[int] = None
         self.cached_gif_file: Optional[Any] = None
+        # The GIF is static, so whether it exists is checked only once
+        self.gif_path = Path("media/media.gif")
+        self.gif_available = self.gif_path.is_file()
         self.processing_groups: Set[int] = set()
+        # Latest bot reply per chat; this process is the only writer, so the
+        # table is read once at startup and kept in sync on every reply
+        self.chat_latest_message_ids: Dict[int, int] = {}
+        # Navigation updates wait this long (seconds) so a burst of posts
+        # results in a single delete + send
+        self.nav_update_delay = 1.5
+        self.nav_update_task: Optional[asyncio.Task] = None
+        self.nav_update_lock = asyncio.Lock()
+        # Pin notifications are deleted in batches collected over this delay
+        self.pin_delete_delay = 0.5
+        self.pin_notifications: List[int] = []
+        self.pin_delete_task: Optional[asyncio.Task] = None
+        # Channel history is read in pages of this many posts (the API maximum
+        # per request), with up to history_queue_size pages fetched ahead
+        self.history_page_size = 100
+        self.history_queue_size = 4
+
+        # Command word -> handler, one entry per alias
+        self.commands: Dict[str, CommandHandler] = {}
+        for aliases, handler in (
+            (CMD_STATS, self._handle_stats_command),
+            (CMD_WGADD, self._handle_wg_add_command),
+            (CMD_WGREMOVE, self._handle_wg_remove_command),
+            (CMD_WGRENAME, self._handle_wg_rename_command),
+            (CMD_WGLIST, self._handle_wg_list_command),
+            (CMD_WGCONFIG, self._handle_wg_config_command),
+            (CMD_HELP, self._handle_help_command),
+            (CMD_HASHTAG_REMOVE, self._handle_hashtag_remove_command),
+            (CMD_HASHTAG_LIST, self._handle_hashtag_list_command),
+            (CMD_ZAPRET_ADD, self._handle_zapret_add_command),
+            (CMD_ZAPRET_CHECK, self._handle_zapret_check_command),
+        ):
+            self.commands.update(dict.fromkeys(aliases, handler))
 
         # Configure logging
         self.logger = logging.getLogger(self.__class__.__name__)
 
+        if not self.gif_available:
+            self.logger.warning("media.gif not found at %s", self.gif_path)
+
         # Load initial state
         self._load_state()
 
@@ -123,6 +178,7 @@ class TelegramBot:
         """Load initial state from database"""
         self.hashtags = self.db.get_hashtags()
         self.nav_message_id = self.db.get_navigation_message_id()
+        self.chat_latest_message_ids = self.db.get_all_chat_latest_message_ids()
         self.logger.info(
             "Loaded initial state: %d hashtags, nav message ID: %s",
             len(self.hashtags),
@@ -139,21 +195,12 @@ class TelegramBot:
             events.ChatAction(chats=self.config.channel_id, func=lambda e: e.new_pin),
         )
 
-        # Separate handlers for single messages and albums
+        # Albums arrive as one event per message; events.Album groups them
         self.client.add_event_handler(
             self._handle_album,
             events.Album(chats=self.config.channel_id),
         )
 
-        self.client.add_event_handler(
-            self._handle_single_message,
-            events.NewMessage(
-                chats=self.config.channel_id,
-                func=lambda e: e.message.id != self.nav_message_id
-                and not e.message.grouped_id,
-            ),
-        )
-
         # Handler for message edits
         self.client.add_event_handler(
             self._handle_message_edit,
@@ -163,114 +210,47 @@ class TelegramBot:
             ),
         )
 
-        # Handler for WireGuard stats
-        self.client.add_event_handler(
-            self._handle_stats_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().split()[0] in CMD_STATS,
-            ),
-        )
-
-        # Handler for WireGuard management commands
-        self.client.add_event_handler(
-            self._handle_wg_add_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().startswith(CMD_WGADD),
-            ),
-        )
-
-        self.client.add_event_handler(
-            self._handle_wg_remove_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().startswith(CMD_WGREMOVE),
-            ),
-        )
-
-        self.client.add_event_handler(
-            self._handle_wg_rename_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().startswith(CMD_WGRENAME),
-            ),
-        )
-
-        self.client.add_event_handler(
-            self._handle_wg_list_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower() in CMD_WGLIST,
-            ),
-        )
-
-        self.client.add_event_handler(
-            self._handle_wg_config_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().startswith(CMD_WGCONFIG),
-            ),
-        )
-
-        # Add handler for help command
-        self.client.add_event_handler(
-            self._handle_help_command,
-            events.NewMessage(
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower() in CMD_HELP
-            ),
-        )
-
-        # Add handler for hashtag remove command
-        self.client.add_event_handler(
-            self._handle_hashtag_remove_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().startswith(CMD_HASHTAG_REMOVE),
-            ),
-        )
-
-        # Add handler for hashtag list command
-        self.client.add_event_handler(
-            self._handle_hashtag_list_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower() in CMD_HASHTAG_LIST,
-            ),
-        )
-
-        # Add handler for zapret add command
-        self.client.add_event_handler(
-            self._handle_zapret_add_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().split()[0] in CMD_ZAPRET_ADD,
-            ),
-        )
-
-        # Add handler for zapret check command
-        self.client.add_event_handler(
-            self._handle_zapret_check_command,
-            events.NewMessage(
-                from_users=self.config.allowed_chats,
-                func=lambda e: e.message.text
-                and e.message.text.strip().lower().split()[0] in CMD_ZAPRET_CHECK,
-            ),
-        )
+        # Single handler for new channel posts and commands from any chat
+        self.client.add_event_handler(self._handle_new_message, events.NewMessage())
 
         async with self.client:
+            # Upload the navigation GIF now instead of on the first update
+            await self._load_gif_file()
+            dns_flusher = asyncio.create_task(self._flush_dns_periodically())
             self.logger.info("Bot is running. Press Ctrl+C to stop.")
-            await self.client.run_until_disconnected()
+            try:
+                await self.client.run_until_disconnected()
+            finally:
+                dns_flusher.cancel()
+                await self._run_blocking(self.db.flush_dns)
+
+    async def _flush_dns_periodically(self):
+        """Write queued DNS queries every DNS_FLUSH_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(DNS_FLUSH_INTERVAL)
+            await self._run_blocking(self.db.flush_dns)
+
+    async def _run_blocking(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking call on the I/O thread and wait for its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, func, *args)
+
+    async def _dispatch_command(self, event: events.NewMessage.Event):
+        """Run the handler of the command the message starts with, if any"""
+        command = normalize_command(event.message.text)
+        handler = self.commands.get(command)
+        if handler is None:
+            return
+
+        # Help answers everyone (with an access notice), but only when the whole
+        # message is the command; the rest answer only allowed users
+        if command in CMD_HELP:
+            if event.message.text.strip().lower() not in CMD_HELP:
+                return
+        elif event.sender_id not in self.config.allowed_chats:
+            return
+
+        await handler(event)
 
     # --------------------------------------
     # Internal helpers (responses & utilities)
@@ -280,8 +260,15 @@ class TelegramBot:
         self, event: events.common.EventBuilder, text: str
     ):
         """Send text message and perform per-chat cleanup bookkeeping."""
-        new_message = await self.client.send_message(event.chat_id, text)
-        await self._cleanup_and_update_chat(event, new_message.id)
+        # The reply does not depend on the cleanup, so both requests run together
+        new_message, _ = await asyncio.gather(
+            self.client.send_message(event.chat_id, text),
+            self._delete_previous_messages(event),
+        )
+        self.chat_latest_message_ids[event.chat_id] = new_message.id
+        await self._run_blocking(
+            self.db.update_chat_latest_message_id, event.chat_id, new_message.id
+        )
         return new_message
 
     async def _send_file_and_cleanup(
@@ -291,8 +278,14 @@ class TelegramBot:
         caption: Optional[str] = None,
     ):
         """Send file (path or already uploaded object) and cleanup bookkeeping."""
-        new_message = await self.client.send_file(event.chat_id, file, caption=caption)
-        await self._cleanup_and_update_chat(event, new_message.id)
+        new_message, _ = await asyncio.gather(
+            self.client.send_file(event.chat_id, file, caption=caption),
+            self._delete_previous_messages(event),
+        )
+        self.chat_latest_message_ids[event.chat_id] = new_message.id
+        await self._run_blocking(
+            self.db.update_chat_latest_message_id, event.chat_id, new_message.id
+        )
         return new_message
 
     async def _handle_wg_rename_command(self, event: events.NewMessage.Event):
@@ -320,7 +313,9 @@ class TelegramBot:
                     )
 
                     # Rename client
-                    _, message = self.wg_manager.rename_client(old_name, new_name)
+                    _, message = await self._run_blocking(
+                        self.wg_manager.rename_client, old_name, new_name
+                    )
                     message_text = message
 
                     # Log the result
@@ -359,24 +354,45 @@ class TelegramBot:
             self.logger.info(
                 "New pinned message detected. ID: %d", event.action_message.id
             )
-            try:
-                await event.delete()
-                self.logger.info(
-                    "Successfully deleted pin notification for message ID: %d",
-                    event.action_message.id,
-                )
-            except MessageDeleteForbiddenError as e:
-                self.logger.error("Failed to delete pin notification: %s", str(e))
-            except (OSError, IOError, ConnectionError) as e:
-                self.logger.error(
-                    "Unexpected error deleting pin notification: %s",
-                    str(e),
-                    exc_info=True,
+            self.pin_notifications.append(event.action_message.id)
+            if self.pin_delete_task is None:
+                self.pin_delete_task = asyncio.create_task(
+                    self._delete_pin_notifications()
                 )
 
-    async def _handle_single_message(self, event: events.NewMessage.Event):
-        """Handle single (non-album) messages"""
-        await self._process_message_content(event.message)
+    async def _delete_pin_notifications(self):
+        """Delete the pin notifications collected over pin_delete_delay at once"""
+        await asyncio.sleep(self.pin_delete_delay)
+        message_ids, self.pin_notifications = self.pin_notifications, []
+        self.pin_delete_task = None
+
+        try:
+            await self.client.delete_messages(self.config.channel_id, message_ids)
+            self.logger.info(
+                "Successfully deleted pin notifications for message IDs: %s",
+                message_ids,
+            )
+        except MessageDeleteForbiddenError as e:
+            self.logger.error("Failed to delete pin notification: %s", str(e))
+        except (OSError, IOError, ConnectionError) as e:
+            self.logger.error(
+                "Unexpected error deleting pin notification: %s",
+                str(e),
+                exc_info=True,
+            )
+
+    async def _handle_new_message(self, event: events.NewMessage.Event):
+        """Handle single (non-album) channel posts and commands"""
+        message = event.message
+        if (
+            event.chat_id == self.config.channel_id
+            and message.id != self.nav_message_id
+            and not message.grouped_id
+        ):
+            await self._process_message_content(message)
+
+        if message.text:
+            await self._dispatch_command(event)
 
     async def _handle_album(self, event: events.Album.Event):
         """Handle media albums (groups of messages)"""
@@ -392,50 +408,57 @@ class TelegramBot:
             # Find the first message with text (usually the main caption)
             main_message = next((msg for msg in messages if msg.text), messages[0])
 
-            # Combine all text from all messages in the album
-            combined_text = "\n".join(msg.text for msg in messages if msg.text)
+            # Union of the hashtags of every message in the album
+            tags = set()
+            for msg in messages:
+                if msg.text:
+                    tags |= extract_hashtags(msg.text)
 
             # Process as a single message
-            await self._process_message_content(main_message, combined_text)
+            await self._process_message_content(main_message, tags)
         finally:
             self.processing_groups.discard(event.grouped_id)
 
     async def _process_message_content(
-        self, message: types.Message, custom_text: str = None
+        self, message: types.Message, tags: Optional[Set[str]] = None
     ):
-        """Common processing logic for both single messages and albums"""
-        text = custom_text if custom_text is not None else (message.text or "")
-
+        """Common processing logic for both single messages and albums.
+        tags are the hashtags of the post; they are taken from message.text if not given.
+        """
         self.logger.info("Processing message ID: %d", message.id)
 
         # Extract and process hashtags
-        tags = extract_hashtags(text)
+        if tags is None:
+            tags = extract_hashtags(message.text or "")
         need_check_tags = bool(tags) or not self.hashtags
 
-        self.logger.debug(
-            "Message contains hashtags: %s. Need check: %s", tags, need_check_tags
-        )
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Message contains hashtags: %s. Need check: %s", tags, need_check_tags
+            )
 
         # Collect hashtags from channel if storage is empty
         if not self.hashtags and need_check_tags:
             self.logger.info("No existing hashtags. Collecting from channel...")
             extracted_from_channel = await self._collect_posts_from_channel(message.id)
             self.hashtags.update(extracted_from_channel)
-            self.db.update_hashtags(self.hashtags)
+            await self._run_blocking(self.db.add_hashtags, extracted_from_channel)
+            self._invalidate_hashtag_caches()
             self.logger.info(
                 "Collected %d unique hashtags from channel", len(extracted_from_channel)
             )
 
         # Add new hashtags if found
         if tags and need_check_tags:
-            new_tags = [tag for tag in tags if tag not in self.hashtags]
+            new_tags = tags - self.hashtags
             if new_tags:
                 self.logger.info("Adding %d new hashtags: %s", len(new_tags), new_tags)
                 self.hashtags.update(new_tags)
-                self.db.update_hashtags(self.hashtags)
+                await self._run_blocking(self.db.add_hashtags, new_tags)
+                self._invalidate_hashtag_caches()
 
         # Update navigation message
-        await self._update_navigation_message()
+        self._schedule_navigation_update()
 
     async def _handle_message_edit(self, event: events.MessageEdited.Event):
         """Handle message edit events to update hashtags"""
@@ -451,7 +474,7 @@ class TelegramBot:
             )
 
             # Check if there are new hashtags to add
-            new_hashtags = [tag for tag in new_tags if tag not in self.hashtags]
+            new_hashtags = new_tags - self.hashtags
             if new_hashtags:
                 self.logger.info(
                     "Adding %d new hashtags from edit: %s",
@@ -459,49 +482,79 @@ class TelegramBot:
                     new_hashtags,
                 )
                 self.hashtags.update(new_hashtags)
-                self.db.update_hashtags(self.hashtags)
+                await self._run_blocking(self.db.add_hashtags, new_hashtags)
+                self._invalidate_hashtag_caches()
 
                 # Update navigation message
-                await self._update_navigation_message()
+                self._schedule_navigation_update()
             else:
                 self.logger.debug("No new hashtags found in edited message")
         else:
             self.logger.debug("No hashtags found in edited message")
 
     async def _collect_posts_from_channel(self, exclude_post_id: int) -> Set[str]:
-        """Collect hashtags from channel posts"""
+        """Collect hashtags from channel posts.
+        The next page of history is fetched while the current one is scanned.
+        """
         tags = set()
         self.logger.info(
             "Collecting hashtags from channel posts (excluding ID: %d)", exclude_post_id
         )
 
-        async for message in self.client.iter_messages(
-            entity=self.config.channel_id,
-        ):
-            if message.id == exclude_post_id or not message.text:
-                continue
-
-            extracted = extract_hashtags(message.text)
-            if extracted:
-                tags.update(extracted)
-                self.logger.debug(
-                    "Found %d hashtags in message ID: %d", len(extracted), message.id
-                )
+        pages: asyncio.Queue = asyncio.Queue(maxsize=self.history_queue_size)
+
+        async def fetch_pages():
+            # max_id lets the server leave out the excluded post and everything newer
+            max_id = exclude_post_id
+            try:
+                while True:
+                    page = await self.client.get_messages(
+                        self.config.channel_id,
+                        limit=self.history_page_size,
+                        max_id=max_id,
+                    )
+                    if not page:
+                        break
+                    await pages.put(page)
+                    max_id = page[-1].id
+            finally:
+                await pages.put(None)
+
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        fetcher = asyncio.create_task(fetch_pages())
+        try:
+            while (page := await pages.get()) is not None:
+                for message in page:
+                    # Most posts have no hashtags; skip them before calling the extractor
+                    text = message.text
+                    if not text or "#" not in text:
+                        continue
+
+                    extracted = extract_hashtags(text)
+                    if extracted:
+                        tags.update(extracted)
+                        if debug:
+                            self.logger.debug(
+                                "Found %d hashtags in message ID: %d",
+                                len(extracted),
+                                message.id,
+                            )
+            # Re-raises the error if fetching stopped because of one
+            await fetcher
+        finally:
+            fetcher.cancel()
 
         self.logger.info("Total collected unique hashtags: %d", len(tags))
         return tags
 
     async def _load_gif_file(self) -> Optional[Any]:
         """Load and cache GIF file in memory"""
-        gif_path = Path("media/media.gif")
-
-        if not gif_path.exists():
-            self.logger.warning("media.gif not found at %s", gif_path)
+        if not self.gif_available:
             return None
 
         try:
             # Upload file to Telegram and cache the uploaded file object
-            uploaded_file = await self.client.upload_file(gif_path)
+            uploaded_file = await self.client.upload_file(self.gif_path)
             self.cached_gif_file = uploaded_file
 
             self.logger.info("Successfully loaded and cached GIF file")
@@ -511,9 +564,37 @@ class TelegramBot:
             self.logger.error("Failed to load GIF: %s", str(e), exc_info=True)
             return None
 
+    def _schedule_navigation_update(self):
+        """Update the navigation message once no new update was requested for a while"""
+        if self.nav_update_task is not None:
+            self.nav_update_task.cancel()
+        self.nav_update_task = asyncio.create_task(self._delayed_navigation_update())
+        self.nav_update_task.add_done_callback(self._log_navigation_update_error)
+
+    def _log_navigation_update_error(self, task: asyncio.Task):
+        """Log the error of a finished navigation update; nothing else awaits it"""
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.logger.error(
+                "Failed to update navigation message: %s", str(error), exc_info=error
+            )
+
+    async def _delayed_navigation_update(self):
+        """Wait out the debounce delay, then update the navigation message"""
+        await asyncio.sleep(self.nav_update_delay)
+        # From here on the update must not be cancelled halfway; later requests
+        # schedule a new task, and the lock keeps the two from interleaving
+        self.nav_update_task = None
+        async with self.nav_update_lock:
+            await self._update_navigation_message()
+
     async def _update_navigation_message(self):
         """Update or create navigation message with hashtags and GIF"""
-        message_text = prompt_to_text(self.hashtags)
+        if self.nav_text is None:
+            self.nav_text = prompt_to_text(self.hashtags)
+        message_text = self.nav_text
 
         # Try to delete existing message first
         if self.nav_message_id:
@@ -554,7 +635,9 @@ class TelegramBot:
                 )
 
             self.nav_message_id = new_message.id
-            self.db.update_navigation_message_id(new_message.id)
+            await self._run_blocking(
+                self.db.update_navigation_message_id, new_message.id
+            )
             self.logger.info("Created new navigation message ID: %d", new_message.id)
         except (FilePart0MissingError, FilePartMissingError) as e:
             self.logger.error(
@@ -572,7 +655,9 @@ class TelegramBot:
                         caption=message_text,
                     )
                     self.nav_message_id = new_message.id
-                    self.db.update_navigation_message_id(new_message.id)
+                    await self._run_blocking(
+                        self.db.update_navigation_message_id, new_message.id
+                    )
                     self.logger.info(
                         "Created navigation message with reloaded GIF ID: %d",
                         new_message.id,
@@ -588,7 +673,9 @@ class TelegramBot:
                         message_text,
                     )
                     self.nav_message_id = new_message.id
-                    self.db.update_navigation_message_id(new_message.id)
+                    await self._run_blocking(
+                        self.db.update_navigation_message_id, new_message.id
+                    )
                     self.logger.info(
                         "Created text-only navigation message ID: %d", new_message.id
                     )
@@ -606,7 +693,9 @@ class TelegramBot:
                         message_text,
                     )
                     self.nav_message_id = new_message.id
-                    self.db.update_navigation_message_id(new_message.id)
+                    await self._run_blocking(
+                        self.db.update_navigation_message_id, new_message.id
+                    )
                     self.logger.info(
                         "Created text-only navigation message ID: %d", new_message.id
                     )
@@ -621,16 +710,13 @@ class TelegramBot:
                 "Failed to create navigation message: %s", str(e), exc_info=True
             )
 
-    async def _cleanup_and_update_chat(
-        self, event: events.common.EventBuilder, new_message_id: int
-    ):
-        """Delete previous bot message in chat and update latest message id."""
-        previous_message_id = self.db.get_chat_latest_message_id(event.chat_id)
+    async def _delete_previous_messages(self, event: events.common.EventBuilder):
+        """Delete the command message and the previous bot reply in the chat."""
+        previous_message_id = self.chat_latest_message_ids.get(event.chat_id)
         if previous_message_id:
             await self.client.delete_messages(
                 event.chat_id, [event.message.id, previous_message_id]
             )
-        self.db.update_chat_latest_message_id(event.chat_id, new_message_id)
 
     async def _handle_stats_command(self, event: events.NewMessage.Event):
         """Handle stats command by executing wgshow script and sending output to the current chat"""
@@ -638,7 +724,9 @@ class TelegramBot:
         ip = "ip" in message.strip().split()
 
         try:
-            message_text = self.wg_manager.get_clients_stats(ip)
+            message_text = await self._run_blocking(
+                self.wg_manager.get_clients_stats, ip
+            )
             message_text = f"```\n{message_text}\n```"
 
         except (OSError, IOError, ConnectionError) as e:
@@ -667,8 +755,8 @@ class TelegramBot:
 
                 try:
                     # Create client
-                    client = self.wg_manager.add_client(
-                        client_name, created_by=event.sender_id
+                    client = await self._run_blocking(
+                        self.wg_manager.add_client, client_name, event.sender_id
                     )
 
                     message_text = f"Client '{client_name}' successfully added!\n\n"
@@ -723,7 +811,9 @@ class TelegramBot:
 
                 try:
                     # Remove client
-                    success = self.wg_manager.remove_client(client_name)
+                    success = await self._run_blocking(
+                        self.wg_manager.remove_client, client_name
+                    )
 
                     if success:
                         message_text = f"Client '{client_name}' successfully removed!"
@@ -752,7 +842,7 @@ class TelegramBot:
     async def _handle_wg_list_command(self, event: events.NewMessage.Event):
         """Handle WireGuard list clients command"""
         try:
-            clients = self.wg_manager.list_clients()
+            clients = await self._run_blocking(self.wg_manager.list_clients)
 
             if not clients:
                 message_text = "WireGuard clients list is empty"
@@ -788,13 +878,17 @@ class TelegramBot:
                 client_name = parts[1]
 
                 # Get client configuration
-                config = self.wg_manager.get_client_config(client_name)
+                config = await self._run_blocking(
+                    self.wg_manager.get_client_config, client_name
+                )
 
                 if config:
                     message_text = f"```\n{config}\n```"
 
                     # Send configuration file
-                    client = self.wg_manager.db.get_wireguard_client(client_name)
+                    client = await self._run_blocking(
+                        self.wg_manager.db.get_wireguard_client, client_name
+                    )
                     if client and os.path.exists(client[6]):
                         await self._send_file_and_cleanup(
                             event, client[6], caption=message_text
@@ -848,10 +942,11 @@ class TelegramBot:
                 if hashtag in self.hashtags:
                     # Remove hashtag from set and database
                     self.hashtags.discard(hashtag)
-                    self.db.update_hashtags(self.hashtags)
+                    await self._run_blocking(self.db.remove_hashtag, hashtag)
+                    self._invalidate_hashtag_caches()
 
                     # Update navigation message
-                    await self._update_navigation_message()
+                    self._schedule_navigation_update()
 
                     message_text = (
                         f"Hashtag `{hashtag}` successfully removed from navigation!"
@@ -869,24 +964,32 @@ class TelegramBot:
             message_text = f"Command processing error: {str(e)}"
             await self._send_text_and_cleanup(event, message_text)
 
+    def _invalidate_hashtag_caches(self) -> None:
+        """Drop the texts derived from self.hashtags after it changes"""
+        self.nav_text = None
+        self.sorted_hashtags = None
+
     async def _handle_hashtag_list_command(self, event: events.NewMessage.Event):
         """Handle hashtag list command"""
         try:
             if not self.hashtags:
                 message_text = "No hashtags found in navigation"
             else:
-                sorted_hashtags = sorted(self.hashtags)
+                if self.sorted_hashtags is None:
+                    self.sorted_hashtags = sorted(self.hashtags)
+                sorted_hashtags = self.sorted_hashtags
+
+                # Format hashtags in groups of 10 for better readability
+                groups = "\n".join(
+                    " ".join(sorted_hashtags[i : i + 10])
+                    for i in range(0, len(sorted_hashtags), 10)
+                )
                 message_text = (
                     f"**Hashtags in navigation ({len(sorted_hashtags)}):**\n\n"
+                    f"{groups}\n"
+                    f"\nTotal: {len(sorted_hashtags)} hashtags"
                 )
 
-                # Format hashtags in groups of 10 for better readability
-                for i in range(0, len(sorted_hashtags), 10):
-                    group = sorted_hashtags[i : i + 10]
-                    message_text += " ".join(group) + "\n"
-
-                message_text += f"\nTotal: {len(sorted_hashtags)} hashtags"
-
         except (OSError, IOError, ConnectionError) as e:
             self.logger.error("Error in hashtag list command handler: %s", str(e))
             message_text = f"Error getting hashtags list: {str(e)}"
@@ -915,24 +1018,18 @@ class TelegramBot:
         list_name = parts[1].lower().strip()
         sites = parts[2:]
 
-        # Parse sites: normalize to bare domains
-        sites = [normalize_domain(s) for s in sites]
+        # Parse sites: normalize to bare domains, dropping the ones that are empty
+        sites = [domain for domain in map(normalize_domain, sites) if domain]
 
         if not sites:
             message_text = "Error: Provide at least one valid site"
             await self._send_text_and_cleanup(event, message_text)
             return
 
-        existed: List[str] = []
-        writed: List[str] = []
-
         try:
-            for domain in sites:
-                if write_to_zapret_file(list_name, domain):
-                    writed.append(domain)
-                    continue
-                existed.append(domain)
-
+            writed, existed = await self._run_blocking(
+                write_many_to_zapret_file, list_name, sites
+            )
         except (OSError, IOError) as e:
             self.logger.error("Failed to write %s: %s", list_name, str(e))
             message_text = f"Write error: {str(e)}"
@@ -956,17 +1053,20 @@ class TelegramBot:
             await self._send_text_and_cleanup(event, message_text)
             return
 
+        site = normalize_domain(parts[1])
+        if not site:
+            message_text = "Error: Provide a valid site\n\nUsage: `zapretcheck <site>`"
+            await self._send_text_and_cleanup(event, message_text)
+            return
+
         try:
-            site = normalize_domain(parts[1])
-            files = get_all_zapret_files()
-            founded = False
-            for file in files:
-                if check_site_in_zapret_file(file, site):
-                    founded = True
-                    message_text = f"`{site}` —> `{file.name}`"
-                    self.logger.debug("Site {%s} was found in {%s}", site, str(file))
-                    break
-            if not founded:
+            # Every file lookup is a cached set check, so one call on the I/O
+            # thread covers them all
+            file = await self._run_blocking(find_site_in_zapret_files, site)
+            if file is not None:
+                message_text = f"`{site}` —> `{file.name}`"
+                self.logger.debug("Site {%s} was found in {%s}", site, str(file))
+            else:
                 message_text = f"Site `{site}` was not found in files."
                 self.logger.debug("Site {%s} was not found in files.", site)
         except (OSError, IOError, ConnectionError) as e:
@@ -983,8 +1083,9 @@ def main():
         config = Config.from_env()
         bot = TelegramBot(config)
 
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(bot.run())
+        # uvloop is optional; without it the default asyncio loop is used
+        loop_factory = uvloop.new_event_loop if uvloop is not None else None
+        asyncio.run(bot.run(), loop_factory=loop_factory)
 
     except KeyboardInterrupt:
         logging.info("Bot stopped by user")
@@ -1,9 +1,23 @@
+import logging
 import sqlite3
+import threading
 from contextlib import closing
 from pathlib import Path
-from typing import Set, Iterable, Optional, List, Tuple
+from typing import Dict, Set, Iterable, Optional, List, Tuple
 import time
 
+# Applied on every connect: WAL lets reads run while a write commits, and with
+# WAL synchronous=NORMAL only syncs at checkpoints instead of on every commit.
+# Temporary tables stay in memory, the file is read through a 64 MiB mmap and
+# the page cache is 16 MiB (negative cache_size is in KiB)
+SQL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA cache_size=-16384",
+)
+
 SQL_TABLE_HASHTAGS = """
 CREATE TABLE IF NOT EXISTS `hashtags` (tag TEXT PRIMARY KEY UNIQUE)
 """
@@ -43,6 +57,27 @@ CREATE TABLE IF NOT EXISTS `wireguard_clients` (
 )
 """
 
+# dns_queries is read by client and time range and pruned by time;
+# wireguard_clients.name needs none, UNIQUE already creates an index for it
+SQL_INDEX_DNS_CLIENT_TS = """
+CREATE INDEX IF NOT EXISTS `idx_dns_client_ts` ON `dns_queries` (client, ts, domain)
+"""
+SQL_INDEX_DNS_TS = """
+CREATE INDEX IF NOT EXISTS `idx_dns_ts` ON `dns_queries` (ts)
+"""
+SQL_INDEX_WG_CREATED = """
+CREATE INDEX IF NOT EXISTS `idx_wg_created` ON `wireguard_clients` (created_at DESC)
+"""
+
+SQL_INSERT_DNS_QUERY = "INSERT INTO dns_queries (ts, client, domain) VALUES (?, ?, ?)"
+
+# Buffered DNS queries are written in one transaction once this many are
+# pending; the bot also flushes them every DNS_FLUSH_INTERVAL seconds.
+# Queries that failed to save this many flushes in a row are dropped
+DNS_FLUSH_ROWS = 100
+DNS_FLUSH_INTERVAL = 2.0
+DNS_FLUSH_MAX_FAILURES = 3
+
 SQL_GET_NAV_MESSAGE_ID = 'SELECT value FROM storage WHERE key = "navigation_message_id"'
 
 SQL_UPDATE_NAV_MESSAGE_ID = """
@@ -58,16 +93,39 @@ VALUES (?, ?)
 """
 
 SQL_GET_ALL_HASHTAGS = "SELECT `tag` FROM `hashtags`"
-SQL_DELETE_ALL_HASHTAGS = "DELETE FROM `hashtags`"
-SQL_INSERT_HASHTAG = "INSERT INTO hashtags (tag) VALUES (?)"
+SQL_DELETE_HASHTAG = "DELETE FROM hashtags WHERE tag = ?"
+SQL_ADD_HASHTAG = "INSERT OR IGNORE INTO hashtags (tag) VALUES (?)"
 
 SQL_GET_CHAT_MESSAGE_ID = "SELECT latest_message_id FROM chat_messages WHERE chat_id = ?"
+SQL_GET_ALL_CHAT_MESSAGE_IDS = "SELECT chat_id, latest_message_id FROM chat_messages"
 SQL_UPDATE_CHAT_MESSAGE_ID = """
 INSERT OR REPLACE INTO chat_messages (chat_id, latest_message_id)
 VALUES (?, ?)
 """
 SQL_DELETE_CHAT_MESSAGE = "DELETE FROM chat_messages WHERE chat_id = ?"
 
+SQL_INSERT_WIREGUARD_CLIENT = """
+INSERT INTO wireguard_clients
+(name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_MISSING_WIREGUARD_CLIENT = """
+INSERT OR IGNORE INTO wireguard_clients
+(name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_GET_WIREGUARD_CLIENT_NAMES = "SELECT name FROM wireguard_clients"
+
+# LIMIT -1 means no limit
+SQL_GET_TOP_DOMAINS = """
+SELECT domain, COUNT(*) as cnt, MAX(ts) as last_ts
+FROM dns_queries
+WHERE client = ? AND ts >= ?
+GROUP BY domain
+ORDER BY cnt DESC
+LIMIT ?
+"""
+
 
 class SQLite:
     """Class for working with SQLite database of hashtags, settings and WireGuard clients."""
@@ -78,8 +136,12 @@ class SQLite:
 
         :param db_file: Path to the database file
         """
+        self.logger = logging.getLogger(self.__class__.__name__)
         self.file = Path(db_file)
         self.database = sqlite3.connect(self.file, check_same_thread=False)
+        self._pending_dns: List[Tuple[int, str, str]] = []
+        self._pending_dns_lock = threading.Lock()
+        self._dns_flush_failures = 0
         self._initialize_database()
 
     def _initialize_database(self) -> None:
@@ -87,47 +149,78 @@ class SQLite:
         try:
             with self.database as connect:
                 with closing(connect.cursor()) as cursor:
+                    for pragma in SQL_PRAGMAS:
+                        cursor.execute(pragma)
                     cursor.execute(SQL_TABLE_HASHTAGS)
                     cursor.execute(SQL_TABLE_STORAGE)
                     cursor.execute(SQL_TABLE_CHAT_MESSAGES)
                     cursor.execute(SQL_TABLE_DNS_QUERIES)
                     cursor.execute(SQL_TABLE_WIREGUARD_CLIENTS)
+                    cursor.execute(SQL_INDEX_DNS_CLIENT_TS)
+                    cursor.execute(SQL_INDEX_DNS_TS)
+                    cursor.execute(SQL_INDEX_WG_CREATED)
         except sqlite3.Error as e:
-            print(f"Error initializing database: {e}")
+            self.logger.error("Error initializing database: %s", e)
 
     def get_hashtags(self) -> Set[str]:
         """Get all hashtags from the database."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    request = cursor.execute(SQL_GET_ALL_HASHTAGS)
-                    return {row[0] for row in request.fetchall()}
+            request = self.database.execute(SQL_GET_ALL_HASHTAGS)
+            return {row[0] for row in request.fetchall()}
         except sqlite3.Error as e:
-            print(f"Error getting hashtags: {e}")
+            self.logger.error("Error getting hashtags: %s", e)
             return set()
 
     def update_hashtags(self, tags: Iterable[str]) -> None:
-        """Update the hashtags list in the database."""
+        """Update the hashtags list in the database, writing only the rows that differ."""
         try:
             with self.database as connect:
                 with closing(connect.cursor()) as cursor:
-                    cursor.execute(SQL_DELETE_ALL_HASHTAGS)
-                    cursor.executemany(
-                        SQL_INSERT_HASHTAG,
-                        [(tag,) for tag in tags]
-                    )
+                    tags = set(tags)
+                    current = {row[0] for row in cursor.execute(SQL_GET_ALL_HASHTAGS)}
+                    to_remove = current - tags
+                    to_add = tags - current
+                    if to_remove:
+                        cursor.executemany(
+                            SQL_DELETE_HASHTAG, [(tag,) for tag in to_remove]
+                        )
+                    if to_add:
+                        cursor.executemany(SQL_ADD_HASHTAG, [(tag,) for tag in to_add])
         except sqlite3.Error as e:
-            print(f"Error updating hashtags: {e}")
+            self.logger.error("Error updating hashtags: %s", e)
 
-    def get_navigation_message_id(self) -> int:
-        """Get the navigation message ID."""
+    def add_hashtags(self, tags: Iterable[str]) -> None:
+        """Add hashtags to the database, skipping the ones already stored."""
         try:
             with self.database as connect:
                 with closing(connect.cursor()) as cursor:
-                    result = cursor.execute(SQL_GET_NAV_MESSAGE_ID).fetchone()
-                    return int(result[0]) if result else 0
+                    cursor.executemany(SQL_ADD_HASHTAG, [(tag,) for tag in tags])
+        except sqlite3.Error as e:
+            self.logger.error("Error adding hashtags: %s", e)
+
+    def add_hashtag(self, tag: str) -> None:
+        """Add a single hashtag to the database if it is not stored yet."""
+        try:
+            with self.database as connect:
+                connect.execute(SQL_ADD_HASHTAG, (tag,))
+        except sqlite3.Error as e:
+            self.logger.error("Error adding hashtag: %s", e)
+
+    def remove_hashtag(self, tag: str) -> None:
+        """Remove a single hashtag from the database."""
+        try:
+            with self.database as connect:
+                connect.execute(SQL_DELETE_HASHTAG, (tag,))
+        except sqlite3.Error as e:
+            self.logger.error("Error removing hashtag: %s", e)
+
+    def get_navigation_message_id(self) -> int:
+        """Get the navigation message ID."""
+        try:
+            result = self.database.execute(SQL_GET_NAV_MESSAGE_ID).fetchone()
+            return int(result[0]) if result else 0
         except (sqlite3.Error, ValueError) as e:
-            print(f"Error getting message ID: {e}")
+            self.logger.error("Error getting message ID: %s", e)
             return 0
 
     def update_navigation_message_id(self, message_id: int) -> None:
@@ -140,17 +233,15 @@ class SQLite:
                         ("navigation_message_id", str(message_id)),
                     )
         except sqlite3.Error as e:
-            print(f"Error updating message ID: {e}")
+            self.logger.error("Error updating message ID: %s", e)
 
     def get_media_gif_id(self) -> Optional[str]:
         """Get the cached media GIF ID."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    result = cursor.execute(SQL_GET_MEDIA_GIF_ID).fetchone()
-                    return result[0] if result else None
+            result = self.database.execute(SQL_GET_MEDIA_GIF_ID).fetchone()
+            return result[0] if result else None
         except sqlite3.Error as e:
-            print(f"Error getting media GIF ID: {e}")
+            self.logger.error("Error getting media GIF ID: %s", e)
             return None
 
     def update_media_gif_id(self, gif_id: str) -> None:
@@ -163,19 +254,26 @@ class SQLite:
                         ("media_gif_id", gif_id),
                     )
         except sqlite3.Error as e:
-            print(f"Error updating media GIF ID: {e}")
+            self.logger.error("Error updating media GIF ID: %s", e)
 
     def get_chat_latest_message_id(self, chat_id: int) -> Optional[int]:
         """Get the latest message ID for a specific chat."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    result = cursor.execute(SQL_GET_CHAT_MESSAGE_ID, (chat_id,)).fetchone()
-                    return int(result[0]) if result else None
+            result = self.database.execute(SQL_GET_CHAT_MESSAGE_ID, (chat_id,)).fetchone()
+            return int(result[0]) if result else None
         except (sqlite3.Error, ValueError) as e:
-            print(f"Error getting chat message ID: {e}")
+            self.logger.error("Error getting chat message ID: %s", e)
             return None
 
+    def get_all_chat_latest_message_ids(self) -> Dict[int, int]:
+        """Get the latest message ID of every chat, keyed by chat ID."""
+        try:
+            rows = self.database.execute(SQL_GET_ALL_CHAT_MESSAGE_IDS).fetchall()
+            return {int(row[0]): int(row[1]) for row in rows}
+        except (sqlite3.Error, ValueError) as e:
+            self.logger.error("Error getting chat message IDs: %s", e)
+            return {}
+
     def update_chat_latest_message_id(self, chat_id: int, message_id: int) -> None:
         """Update the latest message ID for a specific chat."""
         try:
@@ -183,7 +281,7 @@ class SQLite:
                 with closing(connect.cursor()) as cursor:
                     cursor.execute(SQL_UPDATE_CHAT_MESSAGE_ID, (chat_id, message_id))
         except sqlite3.Error as e:
-            print(f"Error updating chat message ID: {e}")
+            self.logger.error("Error updating chat message ID: %s", e)
 
     def delete_chat_message_record(self, chat_id: int) -> None:
         """Delete the message record for a specific chat."""
@@ -192,43 +290,67 @@ class SQLite:
                 with closing(connect.cursor()) as cursor:
                     cursor.execute(SQL_DELETE_CHAT_MESSAGE, (chat_id,))
         except sqlite3.Error as e:
-            print(f"Error deleting chat message record: {e}")
+            self.logger.error("Error deleting chat message record: %s", e)
 
     def add_dns_query(self, client: str, domain: str) -> None:
-        """Save a DNS query for a client and domain with current timestamp (seconds)."""
+        """Queue a DNS query for a client and domain with current timestamp (seconds).
+        Queries are written in batches, see flush_dns().
+        """
+        with self._pending_dns_lock:
+            self._pending_dns.append((time.time_ns() // 1_000_000_000, client, domain))
+            due = len(self._pending_dns) >= DNS_FLUSH_ROWS
+        if due:
+            self.flush_dns()
+
+    def flush_dns(self) -> None:
+        """Write all queued DNS queries in a single transaction.
+        On error the queries stay queued for the next flush, up to
+        DNS_FLUSH_MAX_FAILURES failed flushes in a row.
+        """
+        with self._pending_dns_lock:
+            batch, self._pending_dns = self._pending_dns, []
+        if not batch:
+            return
         try:
             with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    cursor.execute(
-                        "INSERT INTO dns_queries (ts, client, domain) VALUES (?, ?, ?)",
-                        (int(time.time()), client, domain),
-                    )
+                connect.executemany(SQL_INSERT_DNS_QUERY, batch)
         except sqlite3.Error as e:
-            print(f"Error saving dns query: {e}")
-
-    def get_domains_last_hours(self, client: str, hours: int = 24) -> List[Tuple[str, int, int]]:
-        """Return list of (domain, count, last_ts) for last N hours for a client, sorted by count desc."""
+            self._dns_flush_failures += 1
+            if self._dns_flush_failures >= DNS_FLUSH_MAX_FAILURES:
+                self._dns_flush_failures = 0
+                self.logger.error(
+                    "Error saving dns queries, dropped %d: %s", len(batch), e
+                )
+                return
+            with self._pending_dns_lock:
+                self._pending_dns[:0] = batch
+            self.logger.error(
+                "Error saving %d dns queries, kept for retry: %s", len(batch), e
+            )
+        else:
+            self._dns_flush_failures = 0
+
+    def get_domains_last_hours(
+        self, client: str, hours: int = 24, limit: Optional[int] = None
+    ) -> List[Tuple[str, int, int]]:
+        """Return list of (domain, count, last_ts) for last N hours for a client, sorted by count desc.
+        With limit, only the top `limit` domains are returned.
+        """
+        self.flush_dns()
         try:
             since_ts = int(time.time()) - hours * 3600
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    rows = cursor.execute(
-                        """
-                        SELECT domain, COUNT(*) as cnt, MAX(ts) as last_ts
-                        FROM dns_queries
-                        WHERE client = ? AND ts >= ?
-                        GROUP BY domain
-                        ORDER BY cnt DESC
-                        """,
-                        (client, since_ts),
-                    ).fetchall()
-                    return [(row[0], int(row[1]), int(row[2])) for row in rows]
+            rows = self.database.execute(
+                SQL_GET_TOP_DOMAINS,
+                (client, since_ts, -1 if limit is None else limit),
+            ).fetchall()
+            return [(row[0], int(row[1]), int(row[2])) for row in rows]
         except sqlite3.Error as e:
-            print(f"Error getting domains: {e}")
+            self.logger.error("Error getting domains: %s", e)
             return []
 
     def cleanup_old(self, days: int) -> int:
         """Delete records older than N days. Returns number of deleted rows."""
+        self.flush_dns()
         try:
             cutoff = int(time.time()) - days * 86400
             with self.database as connect:
@@ -236,7 +358,7 @@ class SQLite:
                     cursor.execute("DELETE FROM dns_queries WHERE ts < ?", (cutoff,))
                     return cursor.rowcount or 0
         except sqlite3.Error as e:
-            print(f"Error cleaning up old dns queries: {e}")
+            self.logger.error("Error cleaning up old dns queries: %s", e)
             return 0
 
     def add_wireguard_client(self, name: str, ipv4: str, ipv6: str,
@@ -247,14 +369,28 @@ class SQLite:
             with self.database as connect:
                 with closing(connect.cursor()) as cursor:
                     cursor.execute(
-                        """INSERT INTO wireguard_clients
-                           (name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        SQL_INSERT_WIREGUARD_CLIENT,
                         (name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, int(time.time()), created_by)
                     )
             return True
         except sqlite3.Error as e:
-            print(f"Error adding WireGuard client: {e}")
+            self.logger.error("Error adding WireGuard client: %s", e)
+            return False
+
+    def add_wireguard_clients(self, clients: Iterable[Tuple[str, str, str, str, str, str, str, int]]) -> bool:
+        """Add WireGuard clients in a single transaction, skipping names already stored.
+        Each client is (name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_by).
+        """
+        created_at = int(time.time())
+        try:
+            with self.database as connect:
+                connect.executemany(
+                    SQL_INSERT_MISSING_WIREGUARD_CLIENT,
+                    [(*client[:7], created_at, client[7]) for client in clients],
+                )
+            return True
+        except sqlite3.Error as e:
+            self.logger.error("Error adding WireGuard clients: %s", e)
             return False
 
     def remove_wireguard_client(self, name: str) -> bool:
@@ -265,52 +401,55 @@ class SQLite:
                     cursor.execute("DELETE FROM wireguard_clients WHERE name = ?", (name,))
                     return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error removing WireGuard client: {e}")
+            self.logger.error("Error removing WireGuard client: %s", e)
             return False
 
     def get_wireguard_client(self, name: str) -> Optional[Tuple]:
         """Get WireGuard client information by name."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    result = cursor.execute(
-                        "SELECT name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by FROM wireguard_clients WHERE name = ?",
-                        (name,)
-                    ).fetchone()
-                    return result
+            result = self.database.execute(
+                "SELECT name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by FROM wireguard_clients WHERE name = ?",
+                (name,)
+            ).fetchone()
+            return result
         except sqlite3.Error as e:
-            print(f"Error getting WireGuard client: {e}")
+            self.logger.error("Error getting WireGuard client: %s", e)
             return None
 
+    def get_wireguard_client_names(self) -> Set[str]:
+        """Get the names of all WireGuard clients."""
+        try:
+            return {row[0] for row in self.database.execute(SQL_GET_WIREGUARD_CLIENT_NAMES)}
+        except sqlite3.Error as e:
+            self.logger.error("Error getting WireGuard client names: %s", e)
+            return set()
+
     def list_wireguard_clients(self) -> List[Tuple]:
         """Get list of all WireGuard clients."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    results = cursor.execute(
-                        "SELECT name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by FROM wireguard_clients ORDER BY created_at DESC"
-                    ).fetchall()
-                    return results
+            results = self.database.execute(
+                "SELECT name, ipv4, ipv6, public_key, private_key, preshared_key, config_file, created_at, created_by FROM wireguard_clients ORDER BY created_at DESC"
+            ).fetchall()
+            return results
         except sqlite3.Error as e:
-            print(f"Error listing WireGuard clients: {e}")
+            self.logger.error("Error listing WireGuard clients: %s", e)
             return []
 
     def wireguard_client_exists(self, name: str) -> bool:
         """Check if WireGuard client exists."""
         try:
-            with self.database as connect:
-                with closing(connect.cursor()) as cursor:
-                    result = cursor.execute(
-                        "SELECT 1 FROM wireguard_clients WHERE name = ?",
-                        (name,)
-                    ).fetchone()
-                    return result is not None
+            result = self.database.execute(
+                "SELECT 1 FROM wireguard_clients WHERE name = ?",
+                (name,)
+            ).fetchone()
+            return result is not None
         except sqlite3.Error as e:
-            print(f"Error checking WireGuard client existence: {e}")
+            self.logger.error("Error checking WireGuard client existence: %s", e)
             return False
 
     def close(self) -> None:
-        """Close the database connection."""
+        """Write queued DNS queries and close the database connection."""
+        self.flush_dns()
         self.database.close()
 
     def __del__(self) -> None:
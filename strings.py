@@ -41,14 +41,16 @@ MSG_UNAUTHORIZED_ACCESS = (
     "🚫 **Access Denied!**\n\nYou are not authorized to use this bot."
 )
 
-CMD_WGADD = ("wgadd", "!wgadd", "вгдобавить")
-CMD_WGREMOVE = ("wgremove", "!wgremove", "вгудалить")
-CMD_WGLIST = ("wglist", "!wglist", "вгсписок", "вгклиенты", "wgclients")
-CMD_WGCONFIG = ("wgconfig", "!wgconfig", "вгконфиг")
-CMD_WGRENAME = ("wgrename", "!wgrename", "вгпереименовать")
-CMD_HASHTAG_REMOVE = ("tagremove", "!tagremove", "тегудалить", "тегremove")
-CMD_HASHTAG_LIST = ("taglist", "!taglist", "тегсписок", "тегlist")
-CMD_HELP = ("help", "!help", "помощь", "команды", "commands", "wghelp", "!wghelp")
-CMD_STATS = ("stats", "!stats", "статистика", "wgstats", "wg", "вг")
-CMD_ZAPRET_ADD = ("zapretadd", "!zapretadd")
-CMD_ZAPRET_CHECK = ("zapretcheck", "!zapretcheck")
+# Command aliases are whole words: a message runs a command when its first
+# word (case-insensitive) is one of them, so aliases must not contain spaces
+CMD_WGADD = frozenset({"wgadd", "!wgadd", "вгдобавить"})
+CMD_WGREMOVE = frozenset({"wgremove", "!wgremove", "вгудалить"})
+CMD_WGLIST = frozenset({"wglist", "!wglist", "вгсписок", "вгклиенты", "wgclients"})
+CMD_WGCONFIG = frozenset({"wgconfig", "!wgconfig", "вгконфиг"})
+CMD_WGRENAME = frozenset({"wgrename", "!wgrename", "вгпереименовать"})
+CMD_HASHTAG_REMOVE = frozenset({"tagremove", "!tagremove", "тегудалить", "тегremove"})
+CMD_HASHTAG_LIST = frozenset({"taglist", "!taglist", "тегсписок", "тегlist"})
+CMD_HELP = frozenset({"help", "!help", "помощь", "команды", "commands", "wghelp", "!wghelp"})
+CMD_STATS = frozenset({"stats", "!stats", "статистика", "wgstats", "wg", "вг"})
+CMD_ZAPRET_ADD = frozenset({"zapretadd", "!zapretadd"})
+CMD_ZAPRET_CHECK = frozenset({"zapretcheck", "!zapretcheck"})
@@ -1,11 +1,21 @@
-from re import findall
-from typing import Set, Optional
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, Set, Optional
 from pathlib import Path
 from urllib.parse import urlparse
 
 
+# Hashtags may be in any script (e.g. Cyrillic), so \w stays Unicode-aware
+HASHTAG_PATTERN = re.compile(r"#\w+")
+COMMAND_PATTERN = re.compile(r"\s*(\S+)")
+
+
 def extract_hashtags(text: str) -> Set[str]:
-    return set(findall(r"#\w+", text.lower()))
+    if "#" not in text:
+        return set()
+    # Lower-case only the matches rather than a copy of the whole text
+    return {tag.lower() for tag in HASHTAG_PATTERN.findall(text)}
 
 
 def prompt_to_text(tags: set) -> str:
@@ -15,13 +25,33 @@ def prompt_to_text(tags: set) -> str:
     return f"{header}\n\n**{body}**"
 
 
+SESSIONS_DIR = Path("/opt/userbot/sessions")
+
+
 def get_session_file(name: str, return_as_abs_url: bool = False) -> Path:
-    for file in Path("/opt/userbot/sessions").iterdir():
-        if file.is_file() and file.stem == name and file.suffix == ".session":
-            return file.absolute() if return_as_abs_url else file
+    file = SESSIONS_DIR / f"{name}.session"
+    if name and file.parent == SESSIONS_DIR and file.is_file():
+        return file.absolute() if return_as_abs_url else file
     raise FileNotFoundError(f"{name} doesn't exists.")
 
 
+def normalize_command(text: str) -> str:
+    """Return the first word of text in lower case, or "" if there is none.
+    Only that word is copied, and lower() is skipped for words already in lower case.
+    """
+    match = COMMAND_PATTERN.match(text)
+    if not match:
+        return ""
+    word = match.group(1)
+    return word if word.islower() else word.lower()
+
+
+# Characters that make normalize_domain parse the input as a URL; urlparse
+# also drops embedded tabs and newlines, so those take the slow path too
+URL_DELIMITERS = "/@?#:[\t\r\n"
+
+
+@lru_cache(maxsize=4096)
 def normalize_domain(raw: str) -> Optional[str]:
     """Normalize input to bare domain using urllib.parse.
     Accepts raw domain or URL, strips scheme, credentials, path/query/fragment, and port.
@@ -29,17 +59,79 @@ def normalize_domain(raw: str) -> Optional[str]:
     s = (raw or "").strip().lower()
     if not s:
         return None
+    # A bare domain has nothing for urlparse to strip
+    if not any(c in s for c in URL_DELIMITERS):
+        return s
     parsed = urlparse(s if "://" in s else "http://" + s)
     return parsed.hostname
 
 
+# Sites listed in each zapret file, with the (st_ino, st_mtime_ns, st_size)
+# they were read at
+ZAPRET_SITES_CACHE: dict[Path, tuple[tuple[int, int, int], set[str]]] = {}
+
+
+def file_version(path: Path) -> tuple[int, int, int]:
+    """Return (st_ino, st_mtime_ns, st_size) of path; the mtime alone misses
+    edits within one timestamp tick and copies that keep it (cp -p, rsync -t)
+    """
+    file_stat = os.stat(path)
+    return file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size
+
+
+def load_zapret_sites(path: Path) -> set[str]:
+    """Return the sites listed in a zapret file (lowercased, without comments).
+    The file is read again only when its file_version() changes.
+    """
+    version = file_version(path)
+    cached = ZAPRET_SITES_CACHE.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        sites = {
+            site.lower()
+            for line in f
+            if (site := line.strip()) and not line.startswith("#")
+        }
+    ZAPRET_SITES_CACHE[path] = (version, sites)
+    return sites
+
+
+def write_many_to_zapret_file(
+    name: str, sites: Iterable[str]
+) -> tuple[list[str], list[str]]:
+    """Append the sites not yet listed in a zapret file with a single write.
+    Returns the added sites and the ones that were already there.
+    """
+    path = get_zapret_file_path(name)
+    if path is None:
+        raise FileNotFoundError(f"Zapret list '{name}' not found")
+
+    listed = load_zapret_sites(path)
+    added: list[str] = []
+    existed: list[str] = []
+    for site in sites:
+        if site in listed:
+            existed.append(site)
+        else:
+            listed.add(site)
+            added.append(site)
+
+    if added:
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(site + "\n" for site in added)
+        except OSError:
+            # The cached set already has the new sites; make the next call re-read
+            ZAPRET_SITES_CACHE.pop(path, None)
+            raise
+        ZAPRET_SITES_CACHE[path] = (file_version(path), listed)
+    return added, existed
+
+
 def write_to_zapret_file(name: str | Path, site: str) -> bool:
-    name = get_zapret_file_path(name)
-    with open(name, "a", encoding="utf-8") as f:
-        if check_site_in_zapret_file(name, site):
-            return False
-        f.write(site + "\n")
-        return True
+    added, _ = write_many_to_zapret_file(name, [site])
+    return bool(added)
 
 
 def read_from_zapret_file(name: str) -> list[str]:
@@ -53,13 +145,34 @@ def read_from_zapret_file(name: str) -> list[str]:
 
 
 def check_site_in_zapret_file(name: Path, site: str) -> bool:
-    with open(name, "r", encoding="utf-8") as f:
-        return any(
-            line.strip().lower() == site
-            for line in f
-            if line.strip() and not line.startswith("#")
-        )
-    return False
+    # Stored sites are lowercased, so the lookup must be too
+    return site.lower() in load_zapret_sites(name)
+
+
+ZAPRET_DIR = Path("/etc/zapret")
+ZAPRET_IPSET_DIR = Path("/opt/zapret/ipset")
+# .txt files of each zapret directory by stem, with the file_version() they
+# were listed at
+ZAPRET_DIR_CACHE: dict[Path, tuple[tuple[int, int, int], dict[str, Path]]] = {}
+
+
+def list_zapret_dir(directory: Path) -> dict[str, Path]:
+    """Return the .txt files of a zapret directory by stem.
+    The directory is listed again only when its file_version() changes.
+    """
+    version = file_version(directory)
+    cached = ZAPRET_DIR_CACHE.get(directory)
+    if cached and cached[0] == version:
+        return cached[1]
+    # DirEntry.is_file() uses the file type from readdir, no stat per entry
+    with os.scandir(directory) as entries:
+        files = {
+            entry.name[:-4]: Path(entry.path).absolute()
+            for entry in entries
+            if len(entry.name) > 4 and entry.name.endswith(".txt") and entry.is_file()
+        }
+    ZAPRET_DIR_CACHE[directory] = (version, files)
+    return files
 
 
 def get_zapret_file_path(name: str) -> Optional[Path]:
@@ -71,22 +184,24 @@ def get_zapret_file_path(name: str) -> Optional[Path]:
             name = "zapret-hosts-user-exclude"
         case _:
             pass
-    # Check /etc/zapret first
-    for file in Path("/etc/zapret").iterdir():
-        if file.is_file() and file.stem == name and file.suffix == ".txt":
-            return file.absolute()
-    # Check /opt/zapret/ipsets as fallback
-    for file in Path("/opt/zapret/ipset").iterdir():
-        if file.is_file() and file.stem == name and file.suffix == ".txt":
-            return file.absolute()
+    # Check /etc/zapret first, /opt/zapret/ipset as fallback
+    for directory in (ZAPRET_DIR, ZAPRET_IPSET_DIR):
+        file = list_zapret_dir(directory).get(name)
+        if file:
+            return file
     return None
 
 
 def get_all_zapret_files() -> list[Path]:
-    files: list[Path] = []
-    for file in Path("/etc/zapret").iterdir():
-        if file.is_file() and file.suffix == ".txt":
-            files.append(file)
-    files.append(Path("/opt/zapret/ipset/zapret-hosts-user.txt"))
-    files.append(Path("/opt/zapret/ipset/zapret-hosts-user-exclude.txt"))
+    files: list[Path] = list(list_zapret_dir(ZAPRET_DIR).values())
+    files.append(ZAPRET_IPSET_DIR / "zapret-hosts-user.txt")
+    files.append(ZAPRET_IPSET_DIR / "zapret-hosts-user-exclude.txt")
     return files
+
+
+def find_site_in_zapret_files(site: str) -> Optional[Path]:
+    """Return the first zapret file that lists site, or None if none does."""
+    for file in get_all_zapret_files():
+        if check_site_in_zapret_file(file, site):
+            return file
+    return None
@@ -1,14 +1,51 @@
 import os
 import re
+import base64
 import time
+import stat
 import shutil
 import logging
 import subprocess
+import tempfile
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple, Union
 from dataclasses import dataclass
 from sqlite import SQLite
 
+try:
+    from nacl.bindings import crypto_scalarmult_base
+except ImportError:
+    crypto_scalarmult_base = None
+
+# Client names: letters, digits, underscores and dashes, at most 15 characters
+CLIENT_NAME_PATTERN = re.compile(r"[a-zA-Z0-9_-]{1,15}")
+
+# Prints a new private key, its public key and a preshared key, one per line
+KEYGEN_SCRIPT = (
+    'set -e; priv=$(wg genkey); psk=$(wg genpsk); '
+    'printf "%s\\n" "$priv"; printf "%s\\n" "$priv" | wg pubkey; printf "%s\\n" "$psk"'
+)
+
+# Bits 2..254: host numbers that can be given to clients
+CLIENT_HOSTS_MASK = ((1 << 255) - 1) & ~0b11
+
+# Comment line that starts a client section of the server configuration
+CLIENT_HEADER = "### Client "
+CLIENT_HEADER_LEN = len(CLIENT_HEADER)
+
+
+# Units for handshake ages, largest first; ages under a minute are in seconds
+AGE_UNITS = ((86400, "d"), (3600, "h"), (60, "m"))
+
+
+def format_age(seconds: int) -> str:
+    """Format an age in whole seconds as its largest unit, e.g. '5m назад'"""
+    for size, unit in AGE_UNITS:
+        if seconds >= size:
+            return f"{seconds // size}{unit} назад"
+    return f"{seconds}s назад"
+
 
 @dataclass
 class WireGuardClient:
@@ -23,6 +60,45 @@ class WireGuardClient:
     config_file: str
 
 
+@dataclass
+class ServerConfigScan:
+    """Clients and addresses found in the server configuration"""
+
+    # Client name -> public key of its peer (None if the section has none), in file order
+    clients: Dict[str, Optional[str]]
+    # Every address listed in Address/AllowedIPs, without prefix length
+    addresses: Set[str]
+    # Peer public key -> client name, the reverse of clients
+    names_by_key: Dict[str, str]
+
+
+def scan_server_config(server_config: Path) -> ServerConfigScan:
+    """Read the server configuration once, collecting clients and used addresses"""
+    clients: Dict[str, Optional[str]] = {}
+    addresses: Set[str] = set()
+    current = None
+    with open(server_config, "r", encoding="utf-8") as f:
+        for line in f:
+            if line[:CLIENT_HEADER_LEN] == CLIENT_HEADER:
+                current = line[CLIENT_HEADER_LEN:].strip()
+                clients[current] = None
+                continue
+            key, sep, value = line.partition("=")
+            if not sep:
+                continue
+            key = key.strip()
+            if key == "PublicKey":
+                if current is not None and clients[current] is None:
+                    clients[current] = value.strip()
+            elif key in ("AllowedIPs", "Address"):
+                for addr in value.split(","):
+                    addresses.add(addr.strip().partition("/")[0])
+    names_by_key = {key: name for name, key in clients.items() if key}
+    return ServerConfigScan(
+        clients=clients, addresses=addresses, names_by_key=names_by_key
+    )
+
+
 class WireGuardManager:
     """Manager for WireGuard clients"""
 
@@ -39,9 +115,20 @@ class WireGuardManager:
         self.clients_dir = self.wireguard_dir / "clients"
         self.logger = logging.getLogger(self.__class__.__name__)
         self.db = db or SQLite()
+        # Path of qrencode, looked up on first use
+        self.qrencode_path: Optional[str] = None
+        # Last scan of the server configuration and the (st_ino, st_mtime_ns, st_size) it was made at
+        self._server_scan: Optional[Tuple[Tuple[int, int, int], ServerConfigScan]] = None
 
         # Load server parameters
         self.server_params = self._load_server_params()
+        self.server_nic = self.server_params.get("SERVER_WG_NIC", "wg0")
+        self.server_config = self.wireguard_dir / f"{self.server_nic}.conf"
+        self.client_config_template = self._build_client_config_template()
+        # Client config paths are built as plain strings from this prefix
+        self.client_config_prefix = os.path.join(
+            self.clients_dir, f"{self.server_nic}-client-"
+        )
 
         # Sync existing clients with database
         self._sync_existing_clients()
@@ -52,11 +139,13 @@ class WireGuardManager:
         try:
             if os.path.exists(self.config_path):
                 with open(self.config_path, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if "=" in line:
-                            key, value = line.split("=", 1)
-                            params[key] = value
+                    params = {
+                        key.strip(): value.strip()
+                        for key, sep, value in (
+                            line.partition("=") for line in f.read().splitlines()
+                        )
+                        if sep
+                    }
             else:
                 self.logger.error("Parameters file not found: %s", self.config_path)
         except (OSError, IOError) as e:
@@ -64,23 +153,37 @@ class WireGuardManager:
 
         return params
 
+    def _scan_server_config(self) -> Optional[ServerConfigScan]:
+        """Return the scan of the server configuration, or None if it does not exist.
+        The file is read again only when it is replaced or its modification time or size changes.
+        """
+        try:
+            file_stat = os.stat(self.server_config)
+        except FileNotFoundError:
+            return None
+        version = (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+        if self._server_scan and self._server_scan[0] == version:
+            return self._server_scan[1]
+        scan = scan_server_config(self.server_config)
+        self._server_scan = (version, scan)
+        return scan
+
+    def _client_config_path(self, name: str) -> str:
+        """Path of the configuration file of a client"""
+        return f"{self.client_config_prefix}{name}.conf"
+
     def _sync_existing_clients(self):
         """Sync existing WireGuard clients with database"""
         try:
-            server_config = (
-                self.wireguard_dir
-                / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-            )
-
-            if not server_config.exists():
+            if not self.server_config.exists():
                 self.logger.info("Server config not found, skipping client sync")
                 return
 
             # Get clients from server configuration
-            config_clients = self._get_clients_from_config(server_config)
+            config_clients = self._get_clients_from_config()
 
             # Get clients from database
-            db_clients = {client[0] for client in self.db.list_wireguard_clients()}
+            db_clients = self.db.get_wireguard_client_names()
 
             # Find clients that exist in config but not in database
             missing_in_db = []
@@ -88,11 +191,17 @@ class WireGuardManager:
                 if client_name not in db_clients:
                     missing_in_db.append(client_name)
 
-            # Add missing clients to database
+            # Add missing clients to database in one transaction
+            client_files = self._get_client_config_names() if missing_in_db else set()
+            rows = []
             for client_name in missing_in_db:
-                self._add_missing_client_to_db(client_name)
+                row = self._missing_client_row(client_name, client_name in client_files)
+                if row:
+                    rows.append(row)
 
-            if missing_in_db:
+            if rows and not self.db.add_wireguard_clients(rows):
+                self.logger.error("Failed to save existing clients to database")
+            elif missing_in_db:
                 self.logger.info(
                     "Synced %d existing clients to database: %s",
                     len(missing_in_db),
@@ -104,116 +213,131 @@ class WireGuardManager:
         except Exception as e:
             self.logger.error("Error syncing existing clients: %s", e)
 
-    def _get_clients_from_config(self, server_config: Path) -> List[str]:
+    def _get_clients_from_config(self) -> List[str]:
         """Extract client names from server configuration file"""
-        clients = []
         try:
-            with open(server_config, "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.startswith("### Client "):
-                        client_name = line.replace("### Client ", "").strip()
-                        clients.append(client_name)
+            scan = self._scan_server_config()
         except (OSError, IOError) as e:
             self.logger.error("Error reading client list from configuration: %s", e)
+            return []
 
-        return clients
+        return list(scan.clients) if scan else []
 
-    def _add_missing_client_to_db(self, client_name: str):
-        """Add missing client to database with available information"""
+    def _get_client_config_names(self) -> Set[str]:
+        """Names of the clients that have a configuration file in clients_dir"""
+        prefix = f"{self.server_nic}-client-"
         try:
-            # Try to get client info from config file
-            config_file = (
-                self.clients_dir
-                / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}-client-{client_name}.conf"
-            )
+            with os.scandir(self.clients_dir) as entries:
+                return {
+                    entry.name[len(prefix):-len(".conf")]
+                    for entry in entries
+                    if entry.name.startswith(prefix)
+                    and entry.name.endswith(".conf")
+                    and entry.is_file()
+                }
+        except FileNotFoundError:
+            return set()
 
-            if config_file.exists():
-                # Parse client config file to extract information
-                client_info = self._parse_client_config(config_file)
-
-                if client_info:
-                    # Add to database
-                    self.db.add_wireguard_client(
-                        name=client_name,
-                        ipv4=client_info.get("ipv4", ""),
-                        ipv6=client_info.get("ipv6", ""),
-                        public_key=client_info.get("public_key", ""),
-                        private_key=client_info.get("private_key", ""),
-                        preshared_key=client_info.get("preshared_key", ""),
-                        config_file=str(config_file),
-                        created_by=0,  # Unknown creator
-                    )
-                    self.logger.info(
-                        "Added existing client '%s' to database", client_name
-                    )
-                else:
-                    self.logger.warning(
-                        "Could not parse config file for client '%s'", client_name
-                    )
-            else:
+    def _missing_client_row(self, client_name: str, has_config: bool) -> Optional[Tuple]:
+        """Build the database row of a client missing from the database
+        from the available information, or None if it cannot be built
+        """
+        try:
+            if not has_config:
                 # Config file doesn't exist, add with minimal info
-                self.db.add_wireguard_client(
-                    name=client_name,
-                    ipv4="",
-                    ipv6="",
-                    public_key="",
-                    private_key="",
-                    preshared_key="",
-                    config_file="",
-                    created_by=0,
-                )
                 self.logger.info(
-                    "Added existing client '%s' to database (minimal info)", client_name
+                    "Client '%s' has no config file, adding minimal info", client_name
+                )
+                return (client_name, "", "", "", "", "", "", 0)
+
+            # Parse client config file to extract information
+            config_file = self._client_config_path(client_name)
+            # The peer's public key is already in the server config, which
+            # saves deriving it from the private key with `wg pubkey`
+            client_info = self._parse_client_config(
+                config_file, self._get_client_public_key_from_config(client_name)
+            )
+            if not client_info:
+                self.logger.warning(
+                    "Could not parse config file for client '%s'", client_name
                 )
+                return None
+
+            return (
+                client_name,
+                client_info.get("ipv4", ""),
+                client_info.get("ipv6", ""),
+                client_info.get("public_key", ""),
+                client_info.get("private_key", ""),
+                client_info.get("preshared_key", ""),
+                config_file,
+                0,  # Unknown creator
+            )
 
         except Exception as e:
             self.logger.error(
-                "Error adding missing client '%s' to database: %s", client_name, e
+                "Error reading missing client '%s': %s", client_name, e
             )
+            return None
 
-    def _parse_client_config(self, config_file: Path) -> Optional[Dict[str, str]]:
-        """Parse client configuration file to extract information"""
+    def _parse_client_config(
+        self, config_file: str, public_key: Optional[str] = None
+    ) -> Optional[Dict[str, str]]:
+        """Parse client configuration file to extract information.
+        The public key is derived from the private key unless it is given.
+        """
         try:
             client_info = {}
+            addresses = None
 
             with open(config_file, "r", encoding="utf-8") as f:
-                content = f.read()
-
-                # Extract private key
-                private_key_match = re.search(r"PrivateKey\s*=\s*([^\s\n]+)", content)
-                if private_key_match:
-                    client_info["private_key"] = private_key_match.group(1)
-
-                    # Generate public key from private key
-                    try:
-                        result = subprocess.run(
-                            ["wg", "pubkey"],
-                            input=client_info["private_key"],
-                            capture_output=True,
-                            text=True,
-                            check=True,
+                for line in f:
+                    key, sep, value = line.partition("=")
+                    if not sep:
+                        continue
+                    key = key.strip()
+                    # The first occurrence of each field wins
+                    if key == "PrivateKey":
+                        client_info.setdefault("private_key", value.strip())
+                    elif key == "PresharedKey":
+                        client_info.setdefault("preshared_key", value.strip())
+                    elif key == "Address" and addresses is None:
+                        addresses = value
+
+            # Extract addresses
+            for addr in (addresses or "").split(","):
+                addr = addr.strip()
+                if "." in addr:  # IPv4
+                    client_info["ipv4"] = addr.split("/")[0]
+                elif ":" in addr:  # IPv6
+                    client_info["ipv6"] = addr.split("/")[0]
+
+            # Generate public key from private key
+            if public_key and "private_key" in client_info:
+                client_info["public_key"] = public_key
+            elif client_info.get("private_key") and crypto_scalarmult_base is not None:
+                # X25519 in-process with PyNaCl, same result as `wg pubkey`
+                try:
+                    client_info["public_key"] = base64.b64encode(
+                        crypto_scalarmult_base(
+                            base64.b64decode(client_info["private_key"], validate=True)
                         )
-                        client_info["public_key"] = result.stdout.strip()
-                    except subprocess.CalledProcessError:
-                        pass
-
-                # Extract preshared key
-                preshared_key_match = re.search(
-                    r"PresharedKey\s*=\s*([^\s\n]+)", content
-                )
-                if preshared_key_match:
-                    client_info["preshared_key"] = preshared_key_match.group(1)
-
-                # Extract addresses
-                address_match = re.search(r"Address\s*=\s*([^\s\n]+)", content)
-                if address_match:
-                    addresses = address_match.group(1).split(",")
-                    for addr in addresses:
-                        addr = addr.strip()
-                        if "." in addr:  # IPv4
-                            client_info["ipv4"] = addr.split("/")[0]
-                        elif ":" in addr:  # IPv6
-                            client_info["ipv6"] = addr.split("/")[0]
+                    ).decode()
+                except (ValueError, TypeError):
+                    # Malformed key (bad base64 or not 32 bytes)
+                    pass
+            elif client_info.get("private_key"):
+                try:
+                    result = subprocess.run(
+                        ["wg", "pubkey"],
+                        input=client_info["private_key"],
+                        capture_output=True,
+                        text=True,
+                        check=True,
+                    )
+                    client_info["public_key"] = result.stdout.strip()
+                except subprocess.CalledProcessError:
+                    pass
 
             return client_info if client_info else None
 
@@ -223,170 +347,154 @@ class WireGuardManager:
 
     def _get_available_ipv4(self) -> Optional[str]:
         """Find available IPv4 address for new client"""
-        server_config = (
-            self.wireguard_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-        )
-
-        if not server_config.exists():
+        scan = self._scan_server_config()
+        if scan is None:
             return None
 
-        # Read server configuration
-        with open(server_config, "r", encoding="utf-8") as f:
-            content = f.read()
-
         # Extract base IP (e.g., 10.66.66.1 -> 10.66.66)
         server_ip = self.server_params.get("SERVER_WG_IPV4", "10.66.66.1")
         base_ip = ".".join(server_ip.split(".")[:-1])
 
-        # Find used IP addresses
-        used_ips = set()
-        for match in re.finditer(rf"{re.escape(base_ip)}\.(\d+)", content):
-            used_ips.add(int(match.group(1)))
-
         # Find free IP
-        for i in range(2, 255):
-            if i not in used_ips:
-                return f"{base_ip}.{i}"
-
-        return None
+        host = self._first_free_host(scan, base_ip + ".")
+        return f"{base_ip}.{host}" if host is not None else None
 
     def _get_available_ipv6(self) -> Optional[str]:
         """Find available IPv6 address for new client"""
-        server_config = (
-            self.wireguard_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-        )
-
-        if not server_config.exists():
+        scan = self._scan_server_config()
+        if scan is None:
             return None
 
-        # Read server configuration
-        with open(server_config, "r", encoding="utf-8") as f:
-            content = f.read()
-
         # Extract base IPv6 (e.g., fd42:42:42::1 -> fd42:42:42::)
         server_ipv6 = self.server_params.get("SERVER_WG_IPV6", "fd42:42:42::1")
         base_ipv6 = server_ipv6.rsplit(":", 1)[0] + ":"
 
-        # Find used IPv6 addresses
-        used_ips = set()
-        for match in re.finditer(rf"{re.escape(base_ipv6)}(\d+)", content):
-            used_ips.add(int(match.group(1)))
-
         # Find free IPv6
-        for i in range(2, 255):
-            if i not in used_ips:
-                return f"{base_ipv6}{i}"
-
-        return None
+        host = self._first_free_host(scan, base_ipv6)
+        return f"{base_ipv6}{host}" if host is not None else None
+
+    @staticmethod
+    def _first_free_host(scan: ServerConfigScan, prefix: str) -> Optional[int]:
+        """Lowest host number in 2..254 not used by an address that starts with prefix"""
+        # Bitmap of used host numbers: bit n is set when prefix + n is in use
+        used = 0
+        for addr in scan.addresses:
+            if addr.startswith(prefix):
+                host = addr[len(prefix):]
+                if host.isdigit() and int(host) < 256:
+                    used |= 1 << int(host)
+        free = ~used & CLIENT_HOSTS_MASK
+        # The lowest set bit of free is the first free host
+        return (free & -free).bit_length() - 1 if free else None
 
     def _generate_keys(self) -> Tuple[str, str, str]:
         """Generate keys for client"""
         try:
-            # Generate private key
+            # Private, public and preshared key in one shell run
             result = subprocess.run(
-                ["wg", "genkey"], capture_output=True, text=True, check=True
+                ["sh", "-c", KEYGEN_SCRIPT], capture_output=True, text=True, check=True
             )
-            private_key = result.stdout.strip()
-
-            # Generate public key
-            result = subprocess.run(
-                ["wg", "pubkey"],
-                input=private_key,
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            public_key = result.stdout.strip()
-
-            # Generate preshared key
-            result = subprocess.run(
-                ["wg", "genpsk"], capture_output=True, text=True, check=True
-            )
-            preshared_key = result.stdout.strip()
+            private_key, public_key, preshared_key = result.stdout.split()
 
             return private_key, public_key, preshared_key
 
         except subprocess.CalledProcessError as e:
+            if e.returncode == 127:
+                # The shell could not find wg
+                self.logger.error("WireGuard not installed or not found in PATH")
+                raise FileNotFoundError("wg") from e
             self.logger.error("Error generating keys: %s", e)
             raise
         except FileNotFoundError:
             self.logger.error("WireGuard not installed or not found in PATH")
             raise
 
-    def _update_server_config(self, client: WireGuardClient, remove: bool = False):
-        """Update server configuration"""
-        server_config = (
-            self.wireguard_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-        )
-
-        if not server_config.exists():
+    def _update_server_config(
+        self, client: Union[WireGuardClient, str], remove: bool = False
+    ):
+        """Update server configuration.
+        Removal only needs the client name, which can be passed instead of the client.
+        The file is streamed into a temporary file that then atomically
+        replaces it, so a failed write never leaves a truncated config.
+        """
+        if not self.server_config.exists():
             raise FileNotFoundError("Server configuration not found")
 
-        # Read current configuration
-        with open(server_config, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        # Find client section
-        client_section_start = None
-        client_section_end = None
-
-        for i, line in enumerate(lines):
-            if f"### Client {client.name}" in line:
-                client_section_start = i
-            elif (
-                client_section_start is not None
-                and line.strip() == ""
-                and i > client_section_start
-            ):
-                client_section_end = i
-                break
-
-        if remove:
-            # Remove client section
-            if client_section_start is not None:
-                # Remove whitespace before section
-                if (
-                    client_section_start > 0
-                    and lines[client_section_start - 1].strip() == ""
-                ):
-                    client_section_start -= 1
-
-                if client_section_end is not None:
-                    del lines[client_section_start:client_section_end]
-                else:
-                    # Remove to end of file
-                    del lines[client_section_start:]
-        else:
-            # Add or update client section
+        name = client if isinstance(client, str) else client.name
+
+        # New client section; None when removing
+        client_config = None
+        if not remove:
             client_config = f"""
-### Client {client.name}
+{CLIENT_HEADER}{client.name}
 [Peer]
 PublicKey = {client.public_key}
 PresharedKey = {client.preshared_key}
 AllowedIPs = {client.ipv4}/32,{client.ipv6}/128
 """
 
-            if client_section_start is not None:
-                # Update existing section
-                if client_section_end is not None:
-                    lines[client_section_start : client_section_end + 1] = [
-                        client_config
-                    ]
-                else:
-                    lines[client_section_start:] = [client_config]
-            else:
-                # Add new section at the end
-                lines.append(client_config)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.wireguard_dir, prefix=f".{self.server_config.name}."
+        )
+        try:
+            with open(self.server_config, "r", encoding="utf-8") as src, open(
+                fd, "w", encoding="utf-8"
+            ) as dst:
+                # A client section runs from its header to the next blank line.
+                # The blank line before it is held back so that it can be
+                # dropped together with a removed section
+                pending_blank = None
+                in_section = False
+                found = False
+                for line in src:
+                    blank = line.strip() == ""
+                    if in_section:
+                        if blank:
+                            in_section = False
+                            if remove:
+                                dst.write(line)
+                        continue
+                    if (
+                        not found
+                        and line[:CLIENT_HEADER_LEN] == CLIENT_HEADER
+                        and line[CLIENT_HEADER_LEN:].strip() == name
+                    ):
+                        in_section = found = True
+                        if remove:
+                            pending_blank = None
+                            continue
+                        # Update existing section
+                        line = client_config
+                    if pending_blank is not None:
+                        dst.write(pending_blank)
+                        pending_blank = None
+                    if blank:
+                        pending_blank = line
+                    else:
+                        dst.write(line)
+                if pending_blank is not None:
+                    dst.write(pending_blank)
 
-        # Write updated configuration
-        with open(server_config, "w", encoding="utf-8") as f:
-            f.writelines(lines)
+                # Add new section at the end
+                if client_config and not found:
+                    dst.write(client_config)
+
+                dst.flush()
+                os.fsync(dst.fileno())
+
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(self.server_config).st_mode))
+            os.replace(tmp_path, self.server_config)
+            # Timestamps are coarse: an edit that restores the previous size
+            # could otherwise keep a stale scan
+            self._server_scan = None
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    def _create_client_config(self, client: WireGuardClient):
-        """Create client configuration file"""
+    def _build_client_config_template(self) -> str:
+        """Client configuration with the server side filled in; the client
+        fields are left as format placeholders
+        """
         server_pub_ip = self.server_params.get("SERVER_PUB_IP", "")
         server_port = self.server_params.get("SERVER_PORT", "51820")
         server_pub_key = self.server_params.get("SERVER_PUB_KEY", "")
@@ -400,51 +508,60 @@ AllowedIPs = {client.ipv4}/32,{client.ipv6}/128
         else:
             endpoint = f"{server_pub_ip}:{server_port}"
 
-        # Create client configuration
-        client_config = f"""[Interface]
-PrivateKey = {client.private_key}
-Address = {client.ipv4}/32,{client.ipv6}/128
-DNS = {client_dns_1},{client_dns_2}
+        def escape(value: str) -> str:
+            return value.replace("{", "{{").replace("}", "}}")
+
+        return f"""[Interface]
+PrivateKey = {{private_key}}
+Address = {{ipv4}}/32,{{ipv6}}/128
+DNS = {escape(client_dns_1)},{escape(client_dns_2)}
 
 [Peer]
-PublicKey = {server_pub_key}
-PresharedKey = {client.preshared_key}
-Endpoint = {endpoint}
-AllowedIPs = {allowed_ips}
+PublicKey = {escape(server_pub_key)}
+PresharedKey = {{preshared_key}}
+Endpoint = {escape(endpoint)}
+AllowedIPs = {escape(allowed_ips)}
 """
 
-        # Write configuration to file
-        config_file = (
-            self.clients_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}-client-{client.name}.conf"
+    def _create_client_config(self, client: WireGuardClient):
+        """Create client configuration file"""
+        client_config = self.client_config_template.format(
+            private_key=client.private_key,
+            ipv4=client.ipv4,
+            ipv6=client.ipv6,
+            preshared_key=client.preshared_key,
         )
-        with open(config_file, "w", encoding="utf-8") as f:
-            f.write(client_config)
 
-        # Set file permissions
-        os.chmod(config_file, 0o600)
+        # Write configuration to file, created with owner-only permissions
+        config_file = self._client_config_path(client.name)
+        fd = os.open(config_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            # The mode above only applies to new files; an existing one
+            # may have been created with looser permissions
+            os.fchmod(fd, 0o600)
+            f.write(client_config)
 
-        return str(config_file)
+        return config_file
 
     def _sync_wireguard_safe(self):
         """Synchronize WireGuard configuration safely"""
         try:
-            server_nic = self.server_params.get("SERVER_WG_NIC", "wg0")
-            server_config = self.wireguard_dir / f"{server_nic}.conf"
-
-            if not server_config.exists():
-                self.logger.warning("Server config not found: %s", server_config)
+            if not self.server_config.exists():
+                self.logger.warning("Server config not found: %s", self.server_config)
                 return
 
+            # The stripped config is collected in full before syncconf starts:
+            # piping it directly would let syncconf apply a truncated config
+            # (dropping peers) if wg-quick strip failed halfway. It is passed
+            # on as bytes, without decoding it
+            stripped = subprocess.run(
+                ["wg-quick", "strip", self.server_nic],
+                capture_output=True,
+                check=True,
+            ).stdout
             subprocess.run(
-                ["wg", "syncconf", server_nic, "/dev/stdin"],
-                input=subprocess.run(
-                    ["wg-quick", "strip", server_nic],
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                ).stdout,
-                text=True,
+                ["wg", "syncconf", self.server_nic, "/dev/stdin"],
+                input=stripped,
                 check=True,
             )
 
@@ -454,7 +571,7 @@ AllowedIPs = {allowed_ips}
             self.logger.error("Error synchronizing WireGuard: %s", e)
             self.logger.warning(
                 "You may need to restart WireGuard manually: sudo systemctl restart wg-quick@%s",
-                self.server_params.get("SERVER_WG_NIC", "wg0"),
+                self.server_nic,
             )
         except FileNotFoundError:
             self.logger.warning("WireGuard tools not found, skipping sync")
@@ -475,7 +592,7 @@ AllowedIPs = {allowed_ips}
             RuntimeError: If client creation failed
         """
         # Validate client name
-        if not re.match(r"^[a-zA-Z0-9_-]+$", name) or len(name) > 15:
+        if not CLIENT_NAME_PATTERN.fullmatch(name):
             raise ValueError(
                 "Client name must contain only letters, numbers, underscores and dashes, and not exceed 15 characters"
             )
@@ -556,26 +673,12 @@ AllowedIPs = {allowed_ips}
 
         try:
             # Remove client configuration file
-            config_file = (
-                self.clients_dir
-                / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}-client-{name}.conf"
-            )
-            if config_file.exists():
+            config_file = self._client_config_path(name)
+            if os.path.exists(config_file):
                 os.remove(config_file)
 
-            # Create temporary client object for removal from server configuration
-            client = WireGuardClient(
-                name=name,
-                ipv4="",
-                ipv6="",
-                public_key="",
-                private_key="",
-                preshared_key="",
-                config_file="",
-            )
-
             # Remove client from server configuration
-            self._update_server_config(client, remove=True)
+            self._update_server_config(name, remove=True)
 
             # Synchronize WireGuard configuration
             self._sync_wireguard_safe()
@@ -607,19 +710,21 @@ AllowedIPs = {allowed_ips}
         self.logger.info("Starting rename operation: '%s' -> '%s'", old_name, new_name)
 
         # Validate client names
-        if not re.match(r"^[a-zA-Z0-9_-]+$", old_name) or len(old_name) > 15:
+        if not CLIENT_NAME_PATTERN.fullmatch(old_name):
             raise ValueError(
                 "Old client name must contain only letters, numbers, underscores and dashes, and not exceed 15 characters"
             )
 
-        if not re.match(r"^[a-zA-Z0-9_-]+$", new_name) or len(new_name) > 15:
+        if not CLIENT_NAME_PATTERN.fullmatch(new_name):
             raise ValueError(
                 "New client name must contain only letters, numbers, underscores and dashes, and not exceed 15 characters"
             )
 
-        # Check if old client exists
+        # Check if old client exists; its database row is fetched once and
+        # reused for the public key comparison and the rename itself
         old_exists_in_config = self.client_exists(old_name)
-        old_exists_in_db = self.db.wireguard_client_exists(old_name)
+        client_data = self.db.get_wireguard_client(old_name)
+        old_exists_in_db = client_data is not None
 
         self.logger.info(
             "Client '%s' exists - config: %s, database: %s",
@@ -660,12 +765,11 @@ AllowedIPs = {allowed_ips}
                 return True, f"Client '{old_name}' is already named '{new_name}'"
 
             # Get public key of the old client from database
-            old_client_data = self.db.get_wireguard_client(old_name)
-            if not old_client_data:
+            if not client_data:
                 self.logger.warning("Client '%s' not found in database", old_name)
                 return False, f"Client '{old_name}' not found in database"
 
-            old_public_key = old_client_data[3]  # public_key
+            old_public_key = client_data[3]  # public_key
 
             # Get public key of the client with new name from config
             new_public_key = self._get_client_public_key_from_config(new_name)
@@ -686,8 +790,7 @@ AllowedIPs = {allowed_ips}
                 return False, f"Client '{new_name}' already exists in config"
 
         try:
-            # Get client information from database
-            client_data = self.db.get_wireguard_client(old_name)
+            # Client information from database
             if not client_data:
                 return False, f"Client '{old_name}' data not found in database"
 
@@ -707,18 +810,7 @@ AllowedIPs = {allowed_ips}
             client.config_file = new_config_file
 
             # Update server configuration (remove old, add new)
-            old_client = WireGuardClient(
-                name=old_name,
-                ipv4=client_data[1],
-                ipv6=client_data[2],
-                public_key=client_data[3],
-                private_key=client_data[4],
-                preshared_key=client_data[5],
-                config_file="",
-            )
-
-            # Remove old client from server configuration
-            self._update_server_config(old_client, remove=True)
+            self._update_server_config(old_name, remove=True)
 
             # Add new client to server configuration
             self._update_server_config(client)
@@ -740,11 +832,8 @@ AllowedIPs = {allowed_ips}
             )
 
             # Remove old client configuration file
-            old_config_file = (
-                self.clients_dir
-                / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}-client-{old_name}.conf"
-            )
-            if old_config_file.exists():
+            old_config_file = self._client_config_path(old_name)
+            if os.path.exists(old_config_file):
                 os.remove(old_config_file)
 
             self.logger.info(
@@ -769,22 +858,8 @@ AllowedIPs = {allowed_ips}
             Optional[str]: Public key if found, None otherwise
         """
         try:
-            iface = self.server_params.get("SERVER_WG_NIC", "wg0")
-            config_file = Path(self.wireguard_dir) / f"{iface}.conf"
-
-            if not config_file.exists():
-                return None
-
-            with open(config_file, "r", encoding="utf-8") as f:
-                conf = f.read().splitlines()
-
-            for i, line in enumerate(conf):
-                if line.startswith("### Client") and name in line:
-                    # Look for the public key in the next few lines
-                    for j in range(i + 1, min(i + 10, len(conf))):
-                        if conf[j].startswith("PublicKey = "):
-                            return conf[j].split("=", 1)[1].strip()
-            return None
+            scan = self._scan_server_config()
+            return scan.clients.get(name) if scan else None
 
         except (OSError, IOError) as e:
             self.logger.error("Error reading config file: %s", e)
@@ -800,20 +875,11 @@ AllowedIPs = {allowed_ips}
         Returns:
             bool: True if client exists
         """
-        server_config = (
-            self.wireguard_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-        )
-
-        if not server_config.exists():
-            return False
-
         try:
-            with open(server_config, "r", encoding="utf-8") as f:
-                content = f.read()
-                return f"### Client {name}" in content
+            scan = self._scan_server_config()
         except (OSError, IOError):
             return False
+        return scan is not None and name in scan.clients
 
     def list_clients(self) -> List[str]:
         """
@@ -823,28 +889,18 @@ AllowedIPs = {allowed_ips}
             List[str]: List of client names
         """
         # First get clients from database
-        db_clients = [client[0] for client in self.db.list_wireguard_clients()]
+        clients = self.db.get_wireguard_client_names()
 
         # Also check server configuration for desynchronization
-        server_config = (
-            self.wireguard_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}.conf"
-        )
+        try:
+            scan = self._scan_server_config()
+            if scan:
+                clients.update(scan.clients)
+        except (OSError, IOError) as e:
+            self.logger.error("Error reading client list from configuration: %s", e)
 
-        config_clients = []
-        if server_config.exists():
-            try:
-                with open(server_config, "r", encoding="utf-8") as f:
-                    for line in f:
-                        if line.startswith("### Client "):
-                            client_name = line.replace("### Client ", "").strip()
-                            config_clients.append(client_name)
-            except (OSError, IOError) as e:
-                self.logger.error("Error reading client list from configuration: %s", e)
-
-        # Combine lists and remove duplicates
-        all_clients = list(set(db_clients + config_clients))
-        return sorted(all_clients)
+        # The set already holds each name once
+        return sorted(clients)
 
     def get_client_config(self, name: str) -> Optional[str]:
         """
@@ -856,17 +912,19 @@ AllowedIPs = {allowed_ips}
         Returns:
             Optional[str]: Client configuration or None if not found
         """
-        config_file = (
-            self.clients_dir
-            / f"{self.server_params.get('SERVER_WG_NIC', 'wg0')}-client-{name}.conf"
-        )
+        config_file = self._client_config_path(name)
 
-        if not config_file.exists():
+        if not os.path.exists(config_file):
             return None
 
         try:
-            with open(config_file, "r", encoding="utf-8") as f:
-                return f.read()
+            # Read the whole file in one read() sized by fstat
+            fd = os.open(config_file, os.O_RDONLY)
+            try:
+                data = os.read(fd, os.fstat(fd).st_size)
+            finally:
+                os.close(fd)
+            return data.decode("utf-8")
         except (OSError, IOError) as e:
             self.logger.error("Error reading client configuration: %s", e)
             return None
@@ -881,12 +939,9 @@ AllowedIPs = {allowed_ips}
         Returns:
             str: Formatted clients statistics
         """
-        iface = self.server_params.get("SERVER_WG_NIC", "wg0")
-        config_file = Path(self.wireguard_dir) / f"{iface}.conf"
-
         try:
             result = subprocess.run(
-                ["wg", "show", iface, "dump"],
+                ["wg", "show", self.server_nic, "dump"],
                 check=True,
                 text=True,
                 capture_output=True,
@@ -895,73 +950,57 @@ AllowedIPs = {allowed_ips}
             self.logger.error("Error running wg show: %s", e.stderr)
             return e.stderr
 
-        lines = result.stdout.strip().splitlines()
-        if len(lines) <= 1:
+        # The first dump line describes the interface, the rest are peers
+        peers = result.stdout.partition("\n")[2]
+        if not peers or peers.isspace():
             self.logger.warning("No clients found")
             return "No clients found"
 
-        header_line = f"{'Имя':<20} {'Активность':<15}" + (
-            f" {'IP':<15}" if print_ip else ""
-        )
+        # Row template chosen once; the short one ignores the IP argument
+        row_format = (
+            "{:<20} {:<15} {:<15}" if print_ip else "{:<20} {:<15}"
+        ).format
+        header_line = row_format("Имя", "Активность", "IP")
         now = int(time.time())
 
+        # Client names by peer public key, from the server configuration
+        try:
+            scan = self._scan_server_config()
+        except (OSError, IOError) as e:
+            self.logger.error("Error reading client list from configuration: %s", e)
+            scan = None
+        names_by_key = scan.names_by_key if scan else {}
+
         # Collect client data for sorting
         client_data = []
 
-        for line in lines[1:]:
-            parts = line.split("\t")
+        for line in peers.splitlines():
+            # Peer lines have 8 fields; only the first five are split apart
+            parts = line.split("\t", 7)
             if len(parts) < 8:
                 continue
-            pubkey, _, _, allowed, latest, _, _, _ = parts[:8]
+            pubkey = parts[0]
+            allowed = parts[3]
+            latest = parts[4]
 
-            name = "(без имени)"
-            try:
-                with open(config_file, "r", encoding="utf-8") as f:
-                    conf = f.read().splitlines()
-                for i, l in enumerate(conf):
-                    if pubkey in l:
-                        if i >= 2 and conf[i - 2].startswith("### Client"):
-                            name = conf[i - 2].replace("### Client", "").strip()
-                        break
-            except FileNotFoundError:
-                pass
-
-            # Latest handshake
-            try:
-                latest = int(latest)
-            except ValueError:
-                latest = 0
-            if latest == 0:
-                latest_str = "нет"
-            else:
-                diff = now - latest
-                if diff < 60:
-                    latest_str = f"{diff}s назад"
-                elif diff < 3600:
-                    latest_str = f"{diff // 60}m назад"
-                elif diff < 86400:
-                    latest_str = f"{diff // 3600}h назад"
-                else:
-                    latest_str = f"{diff // 86400}d назад"
+            name = names_by_key.get(pubkey, "(без имени)")
+
+            # Latest handshake (seconds since epoch, 0 if never)
+            latest = int(latest) if latest.isdigit() else 0
+            latest_str = "нет" if latest == 0 else format_age(now - latest)
 
             vpn_ip = ""
             if print_ip:
-                vpn_ip = allowed.split(",")[0].split("/")[0] if allowed else ""
+                vpn_ip = allowed.partition(",")[0].partition("/")[0]
 
-            line_fmt = f"{name:<20} {latest_str:<15}" + (
-                f" {vpn_ip:<15}" if print_ip else ""
-            )
-            client_data.append((name, line_fmt))
+            line_fmt = row_format(name, latest_str, vpn_ip)
+            client_data.append((name.casefold(), line_fmt))
 
-        # Sort clients alphabetically by name
-        client_data.sort(key=lambda x: x[0].lower())
+        # Sort clients alphabetically by name (case-insensitive key stored per row)
+        client_data.sort(key=itemgetter(0))
 
         # Build final output with header and sorted clients
-        out_lines = [header_line]
-        for _, line_fmt in client_data:
-            out_lines.append(line_fmt)
-
-        return "\n".join(out_lines)
+        return "\n".join([header_line, *(line_fmt for _, line_fmt in client_data)])
 
     def get_client_qr_code(self, name: str) -> Optional[str]:
         """
@@ -978,24 +1017,28 @@ AllowedIPs = {allowed_ips}
             return None
 
         try:
-            # Check if qrencode is installed
-            if not shutil.which("qrencode"):
+            # Check if qrencode is installed; once found, its path is kept
+            # (a miss is checked again, so installing it needs no restart)
+            if not self.qrencode_path:
+                self.qrencode_path = shutil.which("qrencode")
+            if not self.qrencode_path:
                 self.logger.warning(
                     "qrencode not installed, QR code cannot be generated"
                 )
                 return None
 
             result = subprocess.run(
-                ["qrencode", "-t", "ansiutf8", "-l", "L"],
-                input=config,
+                [self.qrencode_path, "-t", "ansiutf8", "-l", "L"],
+                input=config.encode("utf-8"),
                 capture_output=True,
-                text=True,
                 check=True,
             )
-            return result.stdout
+            # ansiutf8 output is UTF-8; decoded once here, stderr is left as is
+            return result.stdout.decode("utf-8")
         except subprocess.CalledProcessError as e:
             self.logger.error("Error generating QR code: %s", e)
             return None
         except FileNotFoundError:
             self.logger.warning("qrencode not found in system")
+            self.qrencode_path = None
             return None